@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 06:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("authentication", "0002_syncrecord"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="woocommercecredentials",
+            name="max_concurrency",
+            field=models.PositiveSmallIntegerField(default=4),
+        ),
+    ]
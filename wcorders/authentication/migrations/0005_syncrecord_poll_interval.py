@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-18 06:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("authentication", "0004_synccheckpoint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="syncrecord",
+            name="next_sync_time",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="syncrecord",
+            name="poll_interval",
+            field=models.PositiveIntegerField(default=300),
+        ),
+    ]
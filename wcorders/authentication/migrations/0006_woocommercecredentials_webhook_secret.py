@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 06:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("authentication", "0005_syncrecord_poll_interval"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="woocommercecredentials",
+            name="webhook_secret",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 06:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("authentication", "0006_woocommercecredentials_webhook_secret"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="syncrecord",
+            name="catalogue_sync_time",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
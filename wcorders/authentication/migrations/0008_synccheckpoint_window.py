@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-18 07:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("authentication", "0007_syncrecord_catalogue_sync_time"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="synccheckpoint",
+            name="modified_before",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="synccheckpoint",
+            name="orders_total",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
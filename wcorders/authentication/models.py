@@ -6,6 +6,8 @@ class WooCommerceCredentials(models.Model):
     store_url = models.URLField()
     consumer_key = models.CharField(max_length=255)
     consumer_secret = models.CharField(max_length=255)
+    max_concurrency = models.PositiveSmallIntegerField(default=4)  # Parallel API requests allowed against this store
+    webhook_secret = models.CharField(max_length=255, blank=True)  # Falls back to consumer_secret when empty
 
     def __str__(self):
         return f"{self.user.username}'s WooCommerce Credentials"
@@ -14,6 +16,27 @@ class WooCommerceCredentials(models.Model):
 class SyncRecord(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     last_sync_time = models.DateTimeField()
+    poll_interval = models.PositiveIntegerField(default=300)  # Seconds between scheduled syncs, adapted to order velocity
+    next_sync_time = models.DateTimeField(null=True, blank=True)
+    catalogue_sync_time = models.DateTimeField(null=True, blank=True)  # Every product change before this is imported, in UTC
 
     def __str__(self):
-        return f"{self.user.username} - Last Sync: {self.last_sync_time}"
\ No newline at end of file
+        return f"{self.user.username} - Last Sync: {self.last_sync_time}"
+
+
+class SyncCheckpoint(models.Model):
+    # Progress of one sync run, advanced after every persisted page so an interrupted run can resume
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sync_checkpoints')
+    modified_after = models.DateTimeField()  # Start of the window this run was asked to sync
+    modified_before = models.DateTimeField(null=True, blank=True)  # End of the window, fixed when the run starts
+    watermark = models.DateTimeField()  # Every change up to here (GMT) is persisted
+    orders_total = models.IntegerField(null=True, blank=True)  # Orders in the window when its first page was read
+    pages_done = models.IntegerField(default=0)
+    orders_done = models.IntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        state = f"finished {self.finished_at}" if self.finished_at else f"{self.pages_done} pages done"
+        return f"{self.user.username} - Sync up to {self.watermark} ({state})"
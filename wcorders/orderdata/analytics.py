@@ -0,0 +1,142 @@
+from datetime import datetime, time
+
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import Coalesce, TruncDay, TruncHour, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import DailyProductSales, DailySales, OrderItem, Product, WooCommerceOrder
+
+# Orders that represent money taken; pending, failed, cancelled and draft orders never do.
+# Refunded orders stay in so their refunds offset the revenue.
+REVENUE_STATUSES = ['completed', 'processing', 'on-hold', 'refunded']
+
+# Leaderboard metric -> the annotation it ranks by
+LEADERBOARD_METRICS = {
+    'revenue': 'gross_revenue',
+    'units': 'units_sold',
+    'orders': 'order_count',
+}
+
+TRUNC_FUNCTIONS = {
+    'hour': TruncHour,
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def money(expression):
+    return Coalesce(Sum(expression), 0, output_field=DecimalField(max_digits=14, decimal_places=2))
+
+
+def is_local_midnight(value):
+    return timezone.localtime(value).time() == time.min
+
+
+def revenue_series(user, start, end, interval='day', tzinfo=None, statuses=None):
+    # Whole-day ranges with the default zone and statuses are answered from the DailySales rollup;
+    # anything finer falls back to one grouped query over the tenant's (user, status, date_created)
+    # index. Either way there is a row per non-empty bucket in [start, end).
+    if (
+        interval != 'hour' and statuses is None
+        and tzinfo in (None, timezone.get_current_timezone())
+        and is_local_midnight(start) and is_local_midnight(end)
+    ):
+        yield from rollup_revenue_series(user, start, end, interval)
+        return
+
+    trunc = TRUNC_FUNCTIONS[interval]
+    buckets = (
+        WooCommerceOrder.objects.filter(
+            user=user,
+            status__in=statuses or REVENUE_STATUSES,
+            date_created__gte=start,
+            date_created__lt=end,
+        )
+        .annotate(bucket=trunc('date_created', tzinfo=tzinfo))
+        .values('bucket')
+        .annotate(
+            gross_revenue=money('total'),
+            refunds=money('refund_amount'),
+            orders=Count('id'),
+        )
+        .annotate(net_revenue=F('gross_revenue') - F('refunds'))
+        .order_by('bucket')
+    )
+    for bucket in buckets:
+        yield with_average(bucket)
+
+
+def rollup_revenue_series(user, start, end, interval):
+    # Reads at most one DailySales row per day of the range instead of every order in it
+    days = DailySales.objects.filter(
+        user=user, date__gte=timezone.localtime(start).date(), date__lt=timezone.localtime(end).date(),
+    )
+    if interval != 'day':
+        days = days.annotate(date_bucket=TRUNC_FUNCTIONS[interval]('date')).values('date_bucket')
+    else:
+        days = days.values(date_bucket=F('date'))
+    buckets = (
+        days.annotate(gross_revenue=money('revenue'), refunds=money('refunds'), orders=Coalesce(Sum('orders'), 0))
+        .annotate(net_revenue=F('gross_revenue') - F('refunds'))
+        .order_by('date_bucket')
+    )
+    for bucket in buckets:
+        bucket['bucket'] = timezone.make_aware(datetime.combine(bucket.pop('date_bucket'), time.min))
+        yield with_average(bucket)
+
+
+def with_average(bucket):
+    bucket['average_order_value'] = bucket['gross_revenue'] / bucket['orders'] if bucket['orders'] else 0
+    return bucket
+
+
+def ranged_orders(user, start, end):
+    return WooCommerceOrder.objects.filter(
+        user=user, status__in=REVENUE_STATUSES, date_created__gte=start, date_created__lt=end,
+    )
+
+
+def product_leaderboard(user, start, end):
+    # Sales per WooCommerce product in [start, end) as an unordered grouped queryset, ranked and
+    # sliced by LeaderboardPagination. Whole-day ranges are summed from DailyProductSales; an order
+    # falls on a single day, so adding up the daily order counts stays exact.
+    if is_local_midnight(start) and is_local_midnight(end):
+        return (
+            DailyProductSales.objects.filter(
+                user=user, date__gte=timezone.localtime(start).date(), date__lt=timezone.localtime(end).date(),
+                wc_product_id__gt=0,
+            )
+            .values('wc_product_id')
+            .annotate(gross_revenue=money('revenue'), units_sold=Sum('quantity'), order_count=Sum('orders'))
+        )
+    return (
+        OrderItem.objects.filter(order__in=ranged_orders(user, start, end), wc_product_id__gt=0)
+        .values('wc_product_id')
+        .annotate(gross_revenue=money('total'), units_sold=Sum('quantity'), order_count=Count('order', distinct=True))
+    )
+
+
+def category_leaderboard(user, start, end):
+    # Line items joined to their order, product and category and grouped per category; orders with
+    # several products of one category count once
+    return (
+        OrderItem.objects.filter(order__in=ranged_orders(user, start, end), product__category__isnull=False)
+        .values(category_id=F('product__category__category_id'), name=F('product__category__name'))
+        .annotate(gross_revenue=money('total'), units_sold=Sum('quantity'), order_count=Count('order', distinct=True))
+    )
+
+
+def label_products(user, rows):
+    # Adds the store's catalogue name and category to a page of product_leaderboard rows in one
+    # query; products not imported yet keep null labels
+    products = {
+        product['product_id']: product
+        for product in Product.objects.filter(user=user, product_id__in=[row['wc_product_id'] for row in rows])
+        .values('product_id', 'name', category_name=F('category__name'))
+    }
+    for row in rows:
+        product = products.get(row['wc_product_id'], {})
+        row['name'] = product.get('name')
+        row['category'] = product.get('category_name')
+    return rows
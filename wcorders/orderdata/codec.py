@@ -0,0 +1,24 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # Optional; the stdlib codec produces the same documents, only slower
+    orjson = None
+else:
+    DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+
+def loads(data):
+    # Accepts bytes or str
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj, default=None):
+    # Always returns compact UTF-8 bytes. `default` is called for types the stdlib codec does not know,
+    # e.g. Decimal. orjson would format datetimes and dataclasses itself (with +00:00 rather than DRF's
+    # Z for UTC), so those are passed through to `default` as well to keep the documents identical.
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=DUMPS_OPTIONS)
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':')).encode()
@@ -0,0 +1,542 @@
+import hashlib
+import json
+import logging
+import threading
+import zlib
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, Exists, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import make_aware
+
+from authentication.models import SyncRecord
+
+from . import codec
+from .rollups import local_date, refresh_daily_rollups
+from .models import (
+    WooCommerceOrder, OrderItem, Customer, Category, Product, Address, PaymentGateway, ShippingMethod, Coupon, Tax,
+    OrderArchive,
+)
+
+logger = logging.getLogger(__name__)
+
+ORDER_UPDATE_FIELDS = [
+    'status', 'total', 'date_created', 'date_modified', 'customer', 'refund_amount', 'payment_gateway',
+    'payload_hash', 'billing_address', 'shipping_address',
+]
+
+# Fields that identify a child row's content when diffing it against the incoming payload
+CHILD_FIELDS = {
+    OrderItem: ['wc_product_id', 'wc_variation_id', 'quantity', 'total'],
+    ShippingMethod: ['method_id', 'method_title', 'total'],
+    Coupon: ['code', 'discount'],
+    Tax: ['total', 'tax_rate', 'tax_region'],
+}
+
+
+def payload_digest(order_data):
+    normalized = json.dumps(order_data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def address_digest(address_data):
+    return hashlib.sha256(json.dumps(address_data, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+def compress_payload(order_data):
+    return zlib.compress(codec.dumps(order_data), 6)
+
+
+def decompress_payload(payload):
+    return codec.loads(zlib.decompress(payload))
+
+
+def child_key(row, fields):
+    key = [row.order_id]
+    for name in fields:
+        field = row._meta.get_field(name)
+        value = field.to_python(getattr(row, field.attname))
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value, sort_keys=True)
+        key.append(value)
+    return tuple(key)
+
+
+# SQLite cannot upgrade two concurrent read transactions to writes, so threads of one process
+# (e.g. scheduler workers) take turns inside write transactions instead of failing with "database is locked".
+_sqlite_write_lock = threading.RLock()
+
+
+@contextmanager
+def write_transaction():
+    if connection.vendor != 'sqlite':
+        with transaction.atomic():
+            yield
+        return
+    with _sqlite_write_lock, transaction.atomic():
+        yield
+
+
+def parse_wc_datetime(value, tz=None):
+    # WooCommerce sends naive timestamps: store-local for date_*, UTC for date_*_gmt
+    parsed = parse_datetime(value) if value else None
+    if parsed and not parsed.tzinfo:
+        parsed = make_aware(parsed, tz)
+    return parsed
+
+
+def payload_modified(order_data):
+    return parse_wc_datetime(order_data.get('date_modified') or order_data['date_created'])
+
+
+def latest_payloads(orders_data):
+    # One payload per order, the most recently modified one; among equal timestamps the later wins
+    latest = {}
+    for order_data in orders_data:
+        current = latest.get(order_data['id'])
+        if current is None or payload_modified(order_data) >= payload_modified(current):
+            latest[order_data['id']] = order_data
+    return list(latest.values())
+
+
+def refresh_customer_stats(customer_ids):
+    # Recomputes total_spent and orders_count from the stored orders in one UPDATE with
+    # grouped subqueries, so re-syncing an order can never count it twice.
+    customer_ids = set(customer_ids) - {None}
+    if not customer_ids:
+        return 0
+    orders = WooCommerceOrder.objects.filter(customer=OuterRef('pk')).order_by().values('customer')
+    return Customer.objects.filter(pk__in=customer_ids).update(
+        total_spent=Coalesce(Subquery(orders.annotate(total_spent=Sum('total')).values('total_spent')), Decimal(0)),
+        orders_count=Coalesce(Subquery(orders.annotate(orders_count=Count('pk')).values('orders_count')), 0),
+    )
+
+
+def link_order_item_products(user, items):
+    # Points unlinked line items of `user`'s orders at the store's Product in one UPDATE with a
+    # correlated subquery, the portable form of UPDATE ... FROM. Items whose product is not
+    # imported yet stay unlinked until a later catalogue sync brings it in.
+    products = Product.objects.filter(user=user, product_id=OuterRef('wc_product_id'))
+    return items.filter(product__isnull=True, wc_product_id__isnull=False).filter(Exists(products)).update(
+        product=Subquery(products.values('pk')[:1])
+    )
+
+
+class OrderImporter:
+    # Writes WooCommerce order payloads a page at a time: one upsert for the orders,
+    # then one delete and one bulk insert per child table, all in a single transaction.
+    # Customers, gateways and products are kept in per-run identity maps so each one is
+    # looked up at most once per run, and unknown ones are resolved with one query per page.
+
+    def __init__(self, user, skip_unchanged=True, archive=True):
+        # rebuild_from_archive turns both off: it must rewrite every order and its input is the archive
+        self.user = user
+        self.skip_unchanged = skip_unchanged
+        self.archive = archive
+        self.reset()
+
+    def reset(self):
+        self.customers = {}  # email -> Customer
+        self.payment_gateways = {}  # gateway_id -> PaymentGateway
+        self.addresses = {}  # address_digest -> Address pk
+
+    def import_page(self, orders_data):
+        # A page can contain the same order twice if it was modified while we paginated, and a webhook
+        # batch can hold several deliveries of one order; keep the latest
+        orders_data = latest_payloads(orders_data)
+        if not orders_data:
+            return []
+
+        try:
+            with write_transaction():
+                digests = {order_data['id']: payload_digest(order_data) for order_data in orders_data}
+                orders_data, existing_ids, previous = self.filter_unchanged(orders_data, digests)
+                if not orders_data:
+                    return []
+                if self.archive:
+                    self.archive_payloads(orders_data)
+                self.resolve_addresses(orders_data)
+                self.resolve_customers(orders_data)
+                self.resolve_payment_gateways(orders_data)
+                orders = self.upsert_orders(orders_data, digests)
+                self.sync_children(orders, orders_data, existing_ids)
+                link_order_item_products(self.user, OrderItem.objects.filter(order__in=orders))
+                refresh_customer_stats({order.customer_id for order in orders} | {customer_id for customer_id, _ in previous})
+                # An order whose date moved changes both its old and its new day
+                refresh_daily_rollups(
+                    self.user, {local_date(order.date_created) for order in orders} | {local_date(date) for _, date in previous}
+                )
+        except Exception:
+            # Rows created inside the rolled back transaction must not linger in the maps
+            self.reset()
+            raise
+
+        logger.info("Imported %d orders for %s", len(orders), self.user)
+        return orders
+
+    def filter_unchanged(self, orders_data, digests):
+        # Overlapping modified_after windows return the same orders again; skip the ones whose
+        # payload digest matches what we stored last time. Redelivered or reordered webhooks can
+        # also carry an older version than the stored one; those are skipped too. Returns the
+        # changed payloads, the order_ids among them that already exist and the
+        # (customer_id, date_created) those orders had.
+        stored = {
+            order_id: (payload_hash, date_modified, customer_id, date_created)
+            for order_id, payload_hash, date_modified, customer_id, date_created in WooCommerceOrder.objects.filter(
+                user=self.user, order_id__in=[order_data['id'] for order_data in orders_data]
+            ).values_list('order_id', 'payload_hash', 'date_modified', 'customer_id', 'date_created')
+        }
+        changed = [
+            order_data for order_data in orders_data
+            if not self.skip_unchanged or order_data['id'] not in stored or (
+                stored[order_data['id']][0] != digests[order_data['id']]
+                and payload_modified(order_data) >= stored[order_data['id']][1]
+            )
+        ]
+        if len(changed) < len(orders_data):
+            logger.info("Skipping %d unchanged or outdated orders", len(orders_data) - len(changed))
+        existing_ids = {order_data['id'] for order_data in changed if order_data['id'] in stored}
+        return changed, existing_ids, {stored[order_id][2:] for order_id in existing_ids}
+
+    def archive_payloads(self, orders_data):
+        # Only changed payloads reach this point; an identical version is already archived
+        OrderArchive.objects.bulk_create(
+            [
+                OrderArchive(
+                    user=self.user,
+                    order_id=order_data['id'],
+                    date_modified=payload_modified(order_data),
+                    payload=compress_payload(order_data),
+                )
+                for order_data in orders_data
+            ],
+            ignore_conflicts=True,
+        )
+
+    def upsert_orders(self, orders_data, digests):
+        orders = []
+        for order_data in orders_data:
+            customer = self.customers.get(order_data['billing'].get('email'))
+            payment_gateway = self.payment_gateways[order_data['payment_method']]
+            orders.append(WooCommerceOrder(
+                user=self.user,
+                order_id=order_data['id'],
+                status=order_data['status'],
+                total=order_data['total'],
+                date_created=parse_wc_datetime(order_data['date_created']),
+                date_modified=payload_modified(order_data),
+                customer=customer,
+                # Refund lines carry a negative 'total'; they have no 'amount' key
+                refund_amount=sum(abs(Decimal(refund.get('total') or 0)) for refund in order_data.get('refunds', [])),
+                payment_gateway=payment_gateway,
+                payload_hash=digests[order_data['id']],
+                billing_address_id=self.address_pk(order_data.get('billing')),
+                shipping_address_id=self.address_pk(order_data.get('shipping')),
+            ))
+
+        WooCommerceOrder.objects.bulk_create(
+            orders,
+            update_conflicts=True,
+            unique_fields=['user', 'order_id'],
+            update_fields=ORDER_UPDATE_FIELDS,
+        )
+
+        # Not every backend returns primary keys for upserted rows, so read them back in one query
+        pks = dict(
+            WooCommerceOrder.objects.filter(user=self.user, order_id__in=[order.order_id for order in orders])
+            .values_list('order_id', 'pk')
+        )
+        for order in orders:
+            order.pk = pks[order.order_id]
+        return orders
+
+    def sync_children(self, orders, orders_data, existing_ids):
+        rows = defaultdict(list)
+        for order, order_data in zip(orders, orders_data):
+            rows[OrderItem] += self.build_order_items(order, order_data['line_items'])
+            rows[ShippingMethod] += self.build_shipping_methods(order, order_data['shipping_lines'])
+            rows[Coupon] += self.build_coupons(order, order_data['coupon_lines'])
+            rows[Tax] += self.build_taxes(order, order_data['tax_lines'])
+
+        # New orders have no children yet; only orders that existed before need diffing
+        existing_orders = [order for order in orders if order.order_id in existing_ids]
+        for model, fields in CHILD_FIELDS.items():
+            self.diff_children(model, fields, existing_orders, rows[model])
+
+    def diff_children(self, model, fields, existing_orders, new_rows):
+        # Keep rows whose content is unchanged, delete the ones that disappeared and insert the rest
+        old_pks = defaultdict(list)
+        if existing_orders:
+            for row in model.objects.filter(order__in=existing_orders).only('pk', 'order', *fields):
+                old_pks[child_key(row, fields)].append(row.pk)
+
+        to_create = []
+        for row in new_rows:
+            pks = old_pks.get(child_key(row, fields))
+            if pks:
+                pks.pop()
+            else:
+                to_create.append(row)
+
+        to_delete = [pk for pks in old_pks.values() for pk in pks]
+        if to_delete:
+            model.objects.filter(pk__in=to_delete).delete()
+        if to_create:
+            model.objects.bulk_create(to_create)
+
+    def address_pk(self, address_data):
+        return self.addresses[address_digest(address_data)] if address_data else None
+
+    def resolve_addresses(self, orders_data):
+        # Addresses are shared by content, so a repeat customer's order reuses the existing rows
+        addresses = {}
+        for order_data in orders_data:
+            for address_data in (order_data.get('billing'), order_data.get('shipping')):
+                if address_data:
+                    addresses[address_digest(address_data)] = address_data
+        missing = addresses.keys() - self.addresses.keys()
+        if not missing:
+            return
+
+        self.addresses.update(Address.objects.filter(address_hash__in=missing).values_list('address_hash', 'pk'))
+        new_digests = missing - self.addresses.keys()
+        if new_digests:
+            # Another store may insert the same address concurrently; the conflict is harmless
+            Address.objects.bulk_create(
+                [Address(address_hash=digest, address=addresses[digest]) for digest in new_digests],
+                ignore_conflicts=True,
+            )
+            self.addresses.update(
+                Address.objects.filter(address_hash__in=new_digests).values_list('address_hash', 'pk')
+            )
+
+    def resolve_customers(self, orders_data):
+        emails = {order_data['billing'].get('email') for order_data in orders_data} - {None, ''}
+        missing = emails - self.customers.keys()
+        if missing:
+            self.customers.update(
+                (customer.email, customer)
+                for customer in Customer.objects.filter(user=self.user, email__in=missing)
+            )
+
+        new_customers = {}
+        changed = {}
+        for order_data in orders_data:
+            billing_data = order_data['billing']
+            email = billing_data.get('email')
+            if not email:
+                logger.warning('Missing email in billing data for order %s. Skipping customer import.', order_data['id'])
+                continue
+
+            customer = self.customers.get(email) or new_customers.get(email)
+            if customer is None:
+                customer = new_customers[email] = Customer(
+                    user=self.user,
+                    email=email,
+                    first_name=billing_data.get('first_name', ''),
+                    last_name=billing_data.get('last_name', ''),
+                    billing_address_id=self.address_pk(billing_data),
+                    shipping_address_id=self.address_pk(order_data.get('shipping')),
+                )
+                continue
+
+            # If the customer already exists, update their information; stats are recomputed from orders
+            details = (
+                billing_data.get('first_name', customer.first_name),
+                billing_data.get('last_name', customer.last_name),
+                self.address_pk(billing_data),
+                self.address_pk(order_data.get('shipping')),
+            )
+            if details != (customer.first_name, customer.last_name, customer.billing_address_id, customer.shipping_address_id):
+                (customer.first_name, customer.last_name, customer.billing_address_id, customer.shipping_address_id) = details
+                if customer.pk:
+                    changed[email] = customer
+
+        if changed:
+            Customer.objects.bulk_update(
+                changed.values(), ['first_name', 'last_name', 'billing_address', 'shipping_address']
+            )
+        if new_customers:
+            Customer.objects.bulk_create(new_customers.values())
+            self.customers.update(
+                (customer.email, customer)
+                for customer in Customer.objects.filter(user=self.user, email__in=new_customers)
+            )
+
+    def resolve_payment_gateways(self, orders_data):
+        gateway_ids = {order_data['payment_method'] for order_data in orders_data}
+        missing = gateway_ids - self.payment_gateways.keys()
+        if not missing:
+            return
+
+        self.payment_gateways.update(
+            (gateway.gateway_id, gateway)
+            for gateway in PaymentGateway.objects.filter(user=self.user, gateway_id__in=missing)
+        )
+        new_gateway_ids = missing - self.payment_gateways.keys()
+        if new_gateway_ids:
+            PaymentGateway.objects.bulk_create(
+                PaymentGateway(
+                    user=self.user,
+                    gateway_id=gateway_id,
+                    name=gateway_id,  # Placeholder, as name might not be available directly in order data
+                    cost_percentage=0,  # Placeholder, needs to be updated with actual data
+                    cost_fixed=0,  # Placeholder, needs to be updated with actual data
+                    total_cost=1  # Placeholder, needs to be updated with actual data
+                )
+                for gateway_id in new_gateway_ids
+            )
+            self.payment_gateways.update(
+                (gateway.gateway_id, gateway)
+                for gateway in PaymentGateway.objects.filter(user=self.user, gateway_id__in=new_gateway_ids)
+            )
+
+    def build_order_items(self, order, items):
+        return [
+            OrderItem(
+                order=order,
+                wc_product_id=item_data.get('product_id') or None,  # 0 for custom line items
+                wc_variation_id=item_data.get('variation_id') or 0,
+                quantity=item_data['quantity'],
+                total=item_data['total']
+            )
+            for item_data in items
+        ]
+
+    def build_shipping_methods(self, order, shipping_methods):
+        return [
+            ShippingMethod(
+                order=order,
+                method_id=shipping_data['method_id'],
+                method_title=shipping_data['method_title'],
+                total=shipping_data['total']
+            )
+            for shipping_data in shipping_methods
+        ]
+
+    def build_coupons(self, order, coupons):
+        return [
+            Coupon(
+                order=order,
+                code=coupon_data['code'],
+                discount=coupon_data['discount']
+            )
+            for coupon_data in coupons
+        ]
+
+    def build_taxes(self, order, taxes):
+        return [
+            Tax(
+                order=order,
+                total=tax_data.get('total', 0),  # Use .get() to handle missing 'total'
+                tax_rate=tax_data.get('rate', 0),  # Use .get() to handle missing 'rate'
+                tax_region=tax_data.get('label', '')  # Use .get() to handle missing 'label'
+            )
+            for tax_data in taxes
+        ]
+
+
+class ProductImporter:
+    # Imports one store's catalogue. Categories come embedded in every product payload, so they
+    # are upserted from there without extra requests and cached for the rest of the run.
+    PAGE_SIZE = 100
+
+    def __init__(self, client, user):
+        self.client = client
+        self.user = user
+        self.categories = {}  # WooCommerce category_id -> Category
+
+    def sync(self, modified_after=None, concurrency=None):
+        # Imports every product changed after `modified_after` (UTC), or the whole catalogue without it.
+        # Returns the number of products written and the time the run started: pages are read by id,
+        # so a product on a page already read can change after a later, newer product was read, and
+        # only the start of the run is a point before which every change has been seen.
+        started = timezone.now()
+        params = {'per_page': self.PAGE_SIZE, 'orderby': 'id', 'order': 'asc'}
+        if modified_after:
+            # Overlap by a second so products sharing the watermark's timestamp are not missed
+            params['modified_after'] = (modified_after - timedelta(seconds=1)).astimezone(dt_timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+            params['dates_are_gmt'] = 'true'
+
+        synced = 0
+        for page, products_data in self.client.iter_pages('products', params, concurrency):
+            with write_transaction():
+                self.import_products(products_data)
+            synced += len(products_data)
+        return synced, started
+
+    def import_products(self, products_data):
+        self.resolve_categories(products_data)
+        products = []
+        for product_data in products_data:
+            category = None
+            if product_data.get('categories'):
+                category = self.categories[product_data['categories'][0]['id']]
+            products.append(Product(
+                user=self.user,
+                product_id=product_data['id'],
+                name=product_data['name'],
+                category=category,
+                price=product_data['price'] or 0,  # Variable products without a price send ''
+            ))
+
+        Product.objects.bulk_create(
+            products,
+            update_conflicts=True,
+            unique_fields=['user', 'product_id'],
+            update_fields=['name', 'category', 'price'],
+        )
+        return products
+
+    def resolve_categories(self, products_data):
+        categories_data = {
+            product_data['categories'][0]['id']: product_data['categories'][0]
+            for product_data in products_data if product_data.get('categories')
+        }
+        missing = categories_data.keys() - self.categories.keys()
+        if not missing:
+            return
+
+        Category.objects.bulk_create(
+            [
+                Category(user=self.user, category_id=category_id, name=categories_data[category_id]['name'])
+                for category_id in missing
+            ],
+            update_conflicts=True,
+            unique_fields=['user', 'category_id'],
+            update_fields=['name'],
+        )
+        self.categories.update(
+            (category.category_id, category)
+            for category in Category.objects.filter(user=self.user, category_id__in=missing)
+        )
+        logger.info("Resolved %d categories", len(missing))
+
+
+def sync_catalogue(client, user, concurrency=None, full=False):
+    # Incremental product sync for one store; SyncRecord.catalogue_sync_time is only advanced once
+    # every changed product has been written, so a failed run is simply repeated from the same point.
+    # `full` refetches the whole catalogue regardless of the watermark.
+    with write_transaction():
+        sync_record, created = SyncRecord.objects.get_or_create(
+            user=user,
+            defaults={'last_sync_time': make_aware(datetime(1970, 1, 1))}
+        )
+
+    modified_after = None if full else sync_record.catalogue_sync_time
+    synced, started = ProductImporter(client, user).sync(modified_after, concurrency)
+    if synced:
+        with write_transaction():
+            linked = link_order_item_products(user, OrderItem.objects.filter(order__user=user))
+        logger.info("Linked %d order items to newly synced products", linked)
+    sync_record.catalogue_sync_time = started
+    with write_transaction():
+        sync_record.save(update_fields=['catalogue_sync_time'])
+    logger.info("Synced %d products for %s", synced, user)
+    return synced
@@ -0,0 +1,175 @@
+import io
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import IntegrityError, connections
+from django.db.models import F
+from django.utils import timezone
+
+from .importer import write_transaction
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+JOB_COMMANDS = {
+    Job.KIND_SYNC: 'sync_orders',
+    Job.KIND_IMPORT: 'first_import_wc_order_data',
+    Job.KIND_PURGE: 'delete_all_orders',
+}
+
+
+def enqueue(user, kind):
+    # Returns (job, created); a job of the same kind already waiting for this user is reused
+    pending = Job.objects.filter(user=user, kind=kind, status=Job.STATUS_PENDING)
+    job = pending.first()
+    if job:
+        return job, False
+    try:
+        with write_transaction():
+            return Job.objects.create(user=user, kind=kind), True
+    except IntegrityError:
+        # Another request created it between our check and insert
+        return pending.get(), False
+
+
+def release_stale_jobs():
+    # Jobs whose worker died mid-run go back to the queue once their lock expires. Released one at a
+    # time: a store whose newer trigger is already waiting as a pending job of the same kind keeps
+    # that one, and the dead job is retired the way finish_job retires a colliding retry.
+    expired = timezone.now() - timedelta(seconds=settings.JOB_LOCK_TIMEOUT)
+    stale = Job.objects.filter(status=Job.STATUS_RUNNING, locked_at__lt=expired)
+    released = 0
+    for pk in stale.values_list('pk', flat=True):
+        try:
+            with write_transaction():
+                released += stale.filter(pk=pk).update(status=Job.STATUS_PENDING, locked_by='', locked_at=None)
+        except IntegrityError:
+            with write_transaction():
+                released += stale.filter(pk=pk).update(
+                    status=Job.STATUS_FAILED, last_error='Worker lost (superseded)', finished_at=timezone.now(),
+                    locked_by='', locked_at=None,
+                )
+    return released
+
+
+def touch_job(job):
+    # Renews the lock of a job this worker still holds; returns False once it was released or taken over
+    with write_transaction():
+        return bool(
+            Job.objects.filter(pk=job.pk, status=Job.STATUS_RUNNING, locked_by=job.locked_by)
+            .update(locked_at=timezone.now())
+        )
+
+
+@contextmanager
+def heartbeat(job):
+    # Keeps a running job's lock fresh for as long as the job runs, however long that is, so only
+    # jobs whose worker died go stale and get released
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(settings.JOB_HEARTBEAT_INTERVAL):
+                try:
+                    if not touch_job(job):
+                        return
+                except Exception:
+                    logger.warning("Heartbeat for job %s failed", job.pk, exc_info=True)
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=beat, name=f'job-{job.pk}-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def claim_next(worker_id):
+    # Claims the oldest runnable job whose user has nothing running. The conditional UPDATE is the
+    # actual claim, so two workers racing for the same row cannot both win, and the partial unique
+    # constraint on running jobs rejects a second job for the same user.
+    now = timezone.now()
+    busy_users = Job.objects.filter(status=Job.STATUS_RUNNING).values('user')
+    candidates = (
+        Job.objects.filter(status=Job.STATUS_PENDING, run_after__lte=now)
+        .exclude(user__in=busy_users)
+        .order_by('run_after', 'pk')
+        .values_list('pk', flat=True)[:10]
+    )
+    for pk in candidates:
+        try:
+            with write_transaction():
+                claimed = Job.objects.filter(pk=pk, status=Job.STATUS_PENDING).update(
+                    status=Job.STATUS_RUNNING,
+                    locked_by=worker_id,
+                    locked_at=now,
+                    attempts=F('attempts') + 1,
+                )
+        except IntegrityError:
+            continue
+        if claimed:
+            return Job.objects.select_related('user').get(pk=pk)
+    return None
+
+
+def claim_for_user(user_id, kind, worker_id):
+    # Records work that the caller runs itself (the sync scheduler) as a job that is already
+    # running, so it takes the same one-running-job-per-user slot as the queue workers. Returns
+    # None while another job of the user runs. Failures are not retried from the queue; the
+    # caller schedules the next attempt.
+    try:
+        with write_transaction():
+            return Job.objects.create(
+                user_id=user_id, kind=kind, status=Job.STATUS_RUNNING, attempts=1, max_attempts=1,
+                locked_by=worker_id, locked_at=timezone.now(),
+            )
+    except IntegrityError:
+        return None
+
+
+def run_job(job):
+    output = io.StringIO()
+    try:
+        with heartbeat(job):
+            call_command(JOB_COMMANDS[job.kind], user=job.user_id, stdout=output, stderr=output)
+    except Exception as e:
+        logger.exception("Job %s failed", job.pk)
+        finish_job(job, output.getvalue(), error=e)
+    else:
+        finish_job(job, output.getvalue())
+
+
+def finish_job(job, output, error=None):
+    job.output = output[-settings.JOB_OUTPUT_LIMIT:]
+    job.locked_by = ''
+    job.locked_at = None
+    if error is None:
+        job.status = Job.STATUS_SUCCEEDED
+        job.last_error = ''
+        job.finished_at = timezone.now()
+    elif job.attempts < job.max_attempts:
+        job.status = Job.STATUS_PENDING
+        job.last_error = str(error)
+        job.run_after = timezone.now() + timedelta(seconds=settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1))
+    else:
+        job.status = Job.STATUS_FAILED
+        job.last_error = str(error)
+        job.finished_at = timezone.now()
+
+    try:
+        with write_transaction():
+            job.save()
+    except IntegrityError:
+        # A retry collided with a newer pending job for the same store; that one covers it
+        with write_transaction():
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.STATUS_FAILED, last_error=f"{job.last_error} (superseded)", finished_at=timezone.now(),
+                locked_by='', locked_at=None, output=job.output,
+            )
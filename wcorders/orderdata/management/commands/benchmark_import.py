@@ -0,0 +1,119 @@
+import io
+import time
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from orderdata.replay import ReplayServer, ReplayStore, generate_synthetic
+from authentication.models import WooCommerceCredentials, SyncCheckpoint
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+class Command(BaseCommand):
+    help = 'Benchmark first_import_wc_order_data and sync_orders against a local WooCommerce replay server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--capture', action='append', default=[], help='Gzip NDJSON capture to serve (repeatable)')
+        parser.add_argument('--orders', type=int, default=2000, help='Synthetic orders to generate when no capture is given')
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--latency-ms', type=int, default=50, help='Delay added to every API response')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of API requests answered with 503')
+        parser.add_argument('--concurrency', type=int, default=4, help='Parallel page requests against the replay store')
+        parser.add_argument('--modify-fraction', type=float, default=0.1, help='Share of orders changed before the incremental sync')
+
+    def handle(self, *args, **kwargs):
+        store = ReplayStore()
+        for path in kwargs['capture']:
+            store.load_capture(path)
+        if not kwargs['capture']:
+            generate_synthetic(store, kwargs['orders'], kwargs['products'], kwargs['categories'], kwargs['seed'])
+
+        server = ReplayServer(store, latency_ms=kwargs['latency_ms'], error_rate=kwargs['error_rate'], seed=kwargs['seed'])
+        server.start()
+        self.stdout.write(self.style.NOTICE(
+            f"Replay server at {server.url} with {store.count('orders')} orders, {kwargs['latency_ms']}ms latency, "
+            f"{kwargs['error_rate']:.0%} errors."
+        ))
+
+        # Everything runs against a throwaway test database, never the configured one
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(WOOCOMMERCE_REQUESTS_PER_SECOND=10000, WOOCOMMERCE_REQUEST_BURST=10000):
+                results = self.run_phases(server, store, kwargs)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            server.shutdown()
+            server.server_close()
+
+        self.report(results)
+
+    def run_phases(self, server, store, options):
+        user = User.objects.create(username='benchmark')
+        WooCommerceCredentials.objects.create(
+            user=user,
+            store_url=server.url,
+            consumer_key='ck_benchmark',
+            consumer_secret='cs_benchmark',
+            max_concurrency=options['concurrency'],
+        )
+
+        results = [self.measure('first import', server, lambda: store.count('orders'),
+                                'first_import_wc_order_data', user=user.pk)]
+
+        def synced_orders():
+            return SyncCheckpoint.objects.filter(user=user).latest('started_at').orders_done
+
+        results.append(self.measure('re-sync (no changes)', server, synced_orders, 'sync_orders', user=user.pk))
+        touched = store.touch_orders(options['modify_fraction'], options['seed'])
+        self.stdout.write(self.style.NOTICE(f'Modified {touched} orders in the replay store.'))
+        # A sync only covers changes made before the second it starts in
+        time.sleep(1)
+        results.append(self.measure('incremental sync', server, synced_orders, 'sync_orders', user=user.pk))
+        return results
+
+    def measure(self, label, server, count_orders, command, **options):
+        queries = [0]
+
+        def count_query(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        requests_before = server.request_count
+        started = time.perf_counter()
+        with connection.execute_wrapper(count_query):
+            call_command(command, stdout=io.StringIO(), **options)
+        elapsed = time.perf_counter() - started
+
+        orders = count_orders()
+        return {
+            'phase': label,
+            'orders': orders,
+            'seconds': elapsed,
+            'orders_per_second': orders / elapsed if elapsed else 0,
+            'http_requests': server.request_count - requests_before,
+            'queries_per_order': queries[0] / orders if orders else float(queries[0]),
+            'peak_rss_mb': self.peak_rss_mb(),
+        }
+
+    def peak_rss_mb(self):
+        if resource is None:
+            return None
+        # ru_maxrss is reported in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def report(self, results):
+        header = f"{'phase':<22}{'orders':>8}{'seconds':>10}{'orders/s':>10}{'HTTP req':>10}{'SQL/order':>11}{'peak RSS MB':>13}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for result in results:
+            rss = f"{result['peak_rss_mb']:.1f}" if result['peak_rss_mb'] is not None else 'n/a'
+            self.stdout.write(
+                f"{result['phase']:<22}{result['orders']:>8}{result['seconds']:>10.2f}{result['orders_per_second']:>10.1f}"
+                f"{result['http_requests']:>10}{result['queries_per_order']:>11.2f}{rss:>13}"
+            )
@@ -1,14 +1,16 @@
 from django.core.management.base import BaseCommand
-from orderdata.models import (
-    WooCommerceOrder, OrderItem, Address, ShippingMethod, Coupon, Tax, Customer, PaymentGateway, Product, Category
-)
+from orderdata.purge import purge_user
 from django.contrib.auth.models import User
 
 class Command(BaseCommand):
     help = 'Delete all existing orders and their respective order data for a specific user'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, required=True, help='ID of the user whose data should be deleted')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows deleted per transaction')
+
     def handle(self, *args, **kwargs):
-        user_id = 2  # Specify the user ID for whom you want to delete data
+        user_id = kwargs['user']
         user = User.objects.filter(id=user_id).first()
         
         if not user:
@@ -17,32 +19,15 @@ class Command(BaseCommand):
         
         self.stdout.write(self.style.NOTICE(f'Deleting all orders and related data for user ID {user_id}...'))
 
-        # Find all orders for the specific user
-        orders = WooCommerceOrder.objects.filter(user=user)
-
-        # Retrieve product IDs associated with the user's orders
-        product_ids = OrderItem.objects.filter(order__in=orders).values_list('product_id', flat=True)
-
-        # Delete related order data for the specific user's orders
-        OrderItem.objects.filter(order__in=orders).delete()
-        Address.objects.filter(order__in=orders).delete()
-        ShippingMethod.objects.filter(order__in=orders).delete()
-        Coupon.objects.filter(order__in=orders).delete()
-        Tax.objects.filter(order__in=orders).delete()
-
-        # Delete orders for the specific user
-        orders.delete()
-
-        # Delete related data directly associated with the user
-        Customer.objects.filter(user=user).delete()
-        PaymentGateway.objects.filter(user=user).delete()
-
-        # Delete products and related data directly associated with the user
-        Product.objects.filter(id__in=product_ids).delete()
+        # The user's products and categories go with the orders; addresses are shared between users and only
+        # removed once no order references them
+        counts = purge_user(user, chunk_size=max(1, kwargs['chunk_size']), progress=self.report_progress)
 
-        # Delete categories and reviews associated with the user's products
-        if product_ids:
-            Category.objects.filter(product__id__in=product_ids).delete()
-            Review.objects.filter(product__id__in=product_ids).delete()
+        summary = ', '.join(f'{count} {name}' for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Successfully deleted all orders and related data for user ID {user_id}: {summary}.'))
 
-        self.stdout.write(self.style.SUCCESS(f'Successfully deleted all orders and related data for user ID {user_id}.'))
+    def report_progress(self, stage, done, total):
+        if total:
+            self.stdout.write(self.style.NOTICE(f'Deleted {done}/{total} {stage}'))
+        else:
+            self.stdout.write(self.style.NOTICE(f'Deleted {done} {stage}'))
@@ -1,274 +1,76 @@
-import requests
-from decimal import Decimal
-from django.core.management.base import BaseCommand
-from django.utils.dateparse import parse_datetime
-from django.utils.timezone import make_aware
-from orderdata.models import (
-    WooCommerceOrder, OrderItem, Customer, Category, Product, Address, PaymentGateway, ShippingMethod, Coupon, Tax
-)
-from authentication.models import WooCommerceCredentials
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from orderdata.importer import OrderImporter, sync_catalogue, write_transaction
+from orderdata.woocommerce import WooCommerceClient, WooCommerceError
+from authentication.models import WooCommerceCredentials, SyncRecord
+
+PAGE_SIZE = 100
 
 class Command(BaseCommand):
     help = 'Import data from WooCommerce'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, required=True, help='ID of the user whose store should be imported')
+
     def handle(self, *args, **kwargs):
-        user_id = 2  # Specify the user ID for whom you want to import data
+        user_id = kwargs['user']
         credentials = WooCommerceCredentials.objects.filter(user_id=user_id).first()
         if not credentials:
             self.stdout.write(self.style.ERROR('No WooCommerce credentials found for the specified user.'))
             return
 
-        # Step 1: Test API connection
-        if not self.test_api_connection(credentials):
-            return
+        started = timezone.now()
+        with WooCommerceClient(credentials) as self.client:
+            # Step 1: Test API connection
+            if not self.test_api_connection(credentials):
+                return
 
-        # Step 2: Import orders in batches
-        all_orders = self.import_orders(credentials)
+            try:
+                # Step 2: Import the product catalogue first so order items can link to their products
+                self.import_products(credentials)
 
-        # Step 3: Collect unique product IDs
-        product_ids = self.collect_unique_product_ids(all_orders)
+                # Step 3: Import orders page by page
+                self.import_orders(credentials)
+            except WooCommerceError as e:
+                raise CommandError(f'Import aborted: {e}')
 
-        # Step 4: Fetch and update product details in batches
-        self.import_products_in_batches(credentials, product_ids)
+        # Step 4: Every order changed before the import started is stored, so incremental syncs start
+        # from there instead of downloading the whole history again
+        with write_transaction():
+            SyncRecord.objects.update_or_create(user_id=user_id, defaults={'last_sync_time': started})
 
         self.stdout.write(self.style.SUCCESS('Successfully imported orders and products.'))
 
     def test_api_connection(self, credentials):
         self.stdout.write(self.style.NOTICE('Testing API connection...'))
-        response = self.get_wc_data(credentials, 'products', {'per_page': 1})
-        if response:
-            self.stdout.write(self.style.SUCCESS('API connection successful.'))
-            return True
-        else:
-            self.stdout.write(self.style.ERROR('API connection failed. Please check the WooCommerce credentials and try again.'))
-            return False
-
-    def get_wc_data(self, credentials, endpoint, params=None):
-        if params is None:
-            params = {}
-        url = f"{credentials.store_url}/wp-json/wc/v3/{endpoint}"
-        auth = (credentials.consumer_key, credentials.consumer_secret)
-        self.stdout.write(self.style.NOTICE(f"Fetching {endpoint} from {url}..."))  # Debug statement
         try:
-            response = requests.get(url, auth=auth, params=params, timeout=10)  # Added timeout
-            self.stdout.write(self.style.NOTICE(f"Response status code: {response.status_code}"))  # Debug statement
-            if response.status_code == 200:
-                self.stdout.write(self.style.NOTICE(f"Fetched {len(response.json())} items from {endpoint}."))
-                return response.json()
-            else:
-                self.stdout.write(self.style.ERROR(f"Failed to fetch {endpoint}: {response.status_code}"))
-                self.stdout.write(self.style.ERROR(f"Response: {response.text}"))
-                return []
-        except requests.exceptions.Timeout:
-            self.stdout.write(self.style.ERROR(f"Request to {endpoint} timed out."))
-            return []
-        except requests.exceptions.RequestException as e:
-            self.stdout.write(self.style.ERROR(f"An error occurred: {e}"))
-            return []
+            self.client.get('products', {'per_page': 1})
+        except WooCommerceError as e:
+            self.stdout.write(self.style.ERROR(f'API connection failed: {e}'))
+            self.stdout.write(self.style.ERROR('Please check the WooCommerce credentials and try again.'))
+            return False
+        self.stdout.write(self.style.SUCCESS('API connection successful.'))
+        return True
 
     def import_orders(self, credentials):
         self.stdout.write(self.style.NOTICE('Importing orders...'))
-        all_orders = []
-        for page in range(1, 11):  # Iterate over 10 pages
-            params = {'per_page': 100, 'page': page}
-            orders = self.get_wc_data(credentials, 'orders', params)
-            if not orders:
-                self.stdout.write(self.style.NOTICE(f'No more orders found after {len(all_orders)} orders.'))
-                break
-            all_orders.extend(orders)
-            self.stdout.write(self.style.NOTICE(f"Fetched {len(orders)} orders from page {page}."))
-
-        if not all_orders:
-            self.stdout.write(self.style.ERROR('No orders found or failed to fetch orders.'))
-            return []
-
-        self.stdout.write(self.style.NOTICE(f'Total orders fetched: {len(all_orders)}'))
-
-        for idx, order_data in enumerate(all_orders, start=1):
-            customer = self.import_customer(credentials.user, order_data['billing'], order_data['total'])
-            payment_gateway = self.import_payment_gateway(credentials.user, order_data['payment_method'])
-            date_created = parse_datetime(order_data['date_created'])
-            date_modified = parse_datetime(order_data['date_modified'])
-
-            if date_created and not date_created.tzinfo:
-                date_created = make_aware(date_created)
-            if date_modified and not date_modified.tzinfo:
-                date_modified = make_aware(date_modified)
-
-            order, created = WooCommerceOrder.objects.update_or_create(
-                user=credentials.user,
-                order_id=order_data['id'],
-                defaults={
-                    'status': order_data['status'],
-                    'total': order_data['total'],
-                    'date_created': date_created,
-                    'date_modified': date_modified,
-                    'customer': customer,
-                    'refund_amount': sum(refund.get('amount', 0) for refund in order_data.get('refunds', [])),
-                    'payment_gateway': payment_gateway
-                }
-            )
-            self.stdout.write(self.style.NOTICE(f"Imported order {idx} of {len(all_orders)}: Order ID {order_data['id']}"))
-
-            # Clear existing related objects to ensure they are overwritten
-            OrderItem.objects.filter(order=order).delete()
-            Address.objects.filter(order=order).delete()
-            ShippingMethod.objects.filter(order=order).delete()
-            Coupon.objects.filter(order=order).delete()
-            Tax.objects.filter(order=order).delete()
-
-            self.import_order_items(order, order_data['line_items'])
-            self.import_addresses(order, order_data['billing'], 'billing')
-            self.import_addresses(order, order_data['shipping'], 'shipping')
-            self.import_shipping_methods(order, order_data['shipping_lines'])
-            self.import_coupons(order, order_data['coupon_lines'])
-            self.import_taxes(order, order_data['tax_lines'])
-
-        return all_orders
-
-    def collect_unique_product_ids(self, orders):
-        product_ids = set()
-        for order_data in orders:
-            for item in order_data['line_items']:
-                product_ids.add(item['product_id'])
-        return list(product_ids)
-
-    def import_customer(self, user, billing_data, order_total):
-        email = billing_data.get('email')
-        if not email:
-            self.stdout.write(self.style.WARNING('Missing email in billing data. Skipping customer import.'))
-            return None
-
-        customer, created = Customer.objects.get_or_create(
-            user=user,
-            email=email,
-            defaults={
-                'first_name': billing_data.get('first_name', ''),
-                'last_name': billing_data.get('last_name', ''),
-                'total_spent': Decimal(order_total),  # Initial order total
-                'orders_count': 1  # Initial order count
-            }
-        )
-        if not created:
-            # If the customer already exists, update their information and increment their stats
-            customer.first_name = billing_data.get('first_name', customer.first_name)
-            customer.last_name = billing_data.get('last_name', customer.last_name)
-            customer.total_spent += Decimal(order_total)  # Add the order total to total spent
-            customer.orders_count += 1  # Increment the order count
-            customer.save()
-
-        return customer
-
-    def import_payment_gateway(self, user, gateway_id):
-        gateway, created = PaymentGateway.objects.update_or_create(
-            user=user,
-            gateway_id=gateway_id,
-            defaults={
-                'name': gateway_id,  # Placeholder, as name might not be available directly in order data
-                'cost_percentage': 0,  # Placeholder, needs to be updated with actual data
-                'cost_fixed': 0,  # Placeholder, needs to be updated with actual data
-                'total_cost': 0  # Placeholder, needs to be updated with actual data
-            }
-        )
-        # Update order count
-        gateway.total_cost += 1
-        gateway.save()
-        return gateway
-
-    def import_order_items(self, order, items):
-        for item_data in items:
-            product_id = item_data['product_id']
-            self.stdout.write(self.style.NOTICE(f"Processing product ID: {product_id}"))  # Debug statement
-            product = Product.objects.filter(product_id=product_id).first()  # Placeholder for now
-            OrderItem.objects.create(
-                order=order,
-                product=product,
-                quantity=item_data['quantity'],
-                total=item_data['total']
-            )
-
-    def import_addresses(self, order, address_data, address_type):
-        customer = order.customer
-        Address.objects.create(
-            order=order,
-            customer=customer,
-            address_type=address_type,
-            address=address_data
-        )
-
-    def import_shipping_methods(self, order, shipping_methods):
-        for shipping_data in shipping_methods:
-            ShippingMethod.objects.create(
-                order=order,
-                method_id=shipping_data['method_id'],
-                method_title=shipping_data['method_title'],
-                total=shipping_data['total']
-            )
-
-    def import_coupons(self, order, coupons):
-        for coupon_data in coupons:
-            Coupon.objects.create(
-                order=order,
-                code=coupon_data['code'],
-                discount=coupon_data['discount']
-            )
-
-    def import_taxes(self, order, taxes):
-        for tax_data in taxes:
-            Tax.objects.create(
-                order=order,
-                total=tax_data.get('total', 0),  # Use .get() to handle missing 'total'
-                tax_rate=tax_data.get('rate', 0),  # Use .get() to handle missing 'rate'
-                tax_region=tax_data.get('label', '')  # Use .get() to handle missing 'label'
-            )
-
-    def import_products_in_batches(self, credentials, product_ids):
-        batch_size = 100
-        for i in range(0, len(product_ids), batch_size):
-            batch_ids = product_ids[i:i+batch_size]
-            self.stdout.write(self.style.NOTICE(f"Fetching product details for batch {i // batch_size + 1}..."))
-            products = self.get_wc_data(credentials, 'products', {'include': ','.join(map(str, batch_ids))})
-            for product_data in products:
-                self.import_product(credentials, product_data)
-
-    def import_product(self, credentials, product_data):
-        category = None
-        if 'categories' in product_data and product_data['categories']:
-            category_data = product_data['categories'][0]
-            self.stdout.write(self.style.NOTICE(f"Fetching category ID: {category_data['id']}"))  # Debug statement
-            category = self.import_category(category_data, credentials)
-
-        product, created = Product.objects.update_or_create(
-            product_id=product_data['id'],
-            defaults={
-                'name': product_data['name'],
-                'category': category,
-                'price': product_data['price'],
-            }
-        )
-        return product
-
-    def import_category(self, category_data, credentials):
-        category_id = category_data['id']
-        self.stdout.write(self.style.NOTICE(f"Fetching category details for ID: {category_id}"))  # Debug statement
-        category_detail = self.get_wc_data(credentials, f'products/categories/{category_id}')
-        self.stdout.write(self.style.NOTICE(f"Fetched category data: {category_detail}"))  # Debug statement
-        
-        # Use category_id as the unique identifier
-        category, created = Category.objects.update_or_create(
-            category_id=category_id,
-            defaults={
-                'name': category_detail['name']
-            }
-        )
-        
-        if not created and category.name != category_detail['name']:
-            self.stdout.write(self.style.NOTICE(f"Updating category name from {category.name} to {category_detail['name']}"))
-            category.name = category_detail['name']
-            category.save()
-
-        self.stdout.write(self.style.NOTICE(f"Imported category: {category.name}"))  # Debug statement
-        return category
-
-
+        importer = OrderImporter(credentials.user)
+        imported = 0
+        params = {'per_page': PAGE_SIZE, 'orderby': 'id', 'order': 'asc'}
+        # Each page is written as soon as it arrives, so only the pages in flight are held in memory
+        for page, orders in self.client.iter_pages('orders', params):
+            written = importer.import_page(orders)
+            imported += len(orders)
+            self.stdout.write(self.style.NOTICE(
+                f"Page {page}: {len(written)} of {len(orders)} orders changed ({imported} processed so far)."
+            ))
+
+        if not imported:
+            self.stdout.write(self.style.ERROR('No orders found.'))
+        else:
+            self.stdout.write(self.style.NOTICE(f'Total orders imported: {imported}'))
 
+    def import_products(self, credentials):
+        self.stdout.write(self.style.NOTICE('Importing products...'))
+        synced = sync_catalogue(self.client, credentials.user, full=True)
+        self.stdout.write(self.style.NOTICE(f'Total products imported: {synced}'))
@@ -0,0 +1,45 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from orderdata.importer import OrderImporter, decompress_payload
+from orderdata.models import OrderArchive
+
+class Command(BaseCommand):
+    help = 'Re-derive a store\'s orders from the archived raw payloads without calling the WooCommerce API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, required=True, help='ID of the user whose orders to rebuild')
+        parser.add_argument('--batch-size', type=int, default=100, help='Orders written per transaction')
+
+    def handle(self, *args, **kwargs):
+        try:
+            user = User.objects.get(pk=kwargs['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {kwargs['user']} does not exist")
+
+        # Every order is rewritten even if its payload hash matches, and nothing is archived again
+        importer = OrderImporter(user, skip_unchanged=False, archive=False)
+        batch_size = max(1, kwargs['batch_size'])
+        rebuilt = 0
+        batch = []
+        for payload in self.latest_payloads(user):
+            batch.append(decompress_payload(payload))
+            if len(batch) >= batch_size:
+                rebuilt += len(importer.import_page(batch))
+                batch = []
+        if batch:
+            rebuilt += len(importer.import_page(batch))
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rebuilt} orders for {user} from the archive.'))
+
+    def latest_payloads(self, user):
+        # Newest version of each order first, so only the first row per order_id is kept
+        versions = (
+            OrderArchive.objects.filter(user=user)
+            .order_by('order_id', '-date_modified')
+            .values_list('order_id', 'payload')
+        )
+        previous = None
+        for order_id, payload in versions.iterator(chunk_size=500):
+            if order_id != previous:
+                previous = order_id
+                yield bytes(payload)
@@ -0,0 +1,25 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from orderdata.importer import write_transaction
+from orderdata.rollups import rebuild_daily_rollups
+
+class Command(BaseCommand):
+    help = 'Regenerate the DailySales and DailyProductSales rollups from the raw order tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='ID of the user whose rollups to rebuild; all users when omitted')
+
+    def handle(self, *args, **kwargs):
+        users = User.objects.all()
+        if kwargs['user'] is not None:
+            users = users.filter(pk=kwargs['user'])
+            if not users.exists():
+                raise CommandError(f"User {kwargs['user']} does not exist")
+
+        for user in users.order_by('pk'):
+            # One transaction per tenant, so dashboards never read a half-rebuilt range
+            with write_transaction():
+                days, products = rebuild_daily_rollups(user)
+            self.stdout.write(self.style.SUCCESS(
+                f'Rebuilt {days} daily and {products} daily product rollups for {user}.'
+            ))
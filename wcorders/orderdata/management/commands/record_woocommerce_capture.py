@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from orderdata.replay import write_capture
+from orderdata.woocommerce import WooCommerceClient, WooCommerceError
+from authentication.models import WooCommerceCredentials
+
+class Command(BaseCommand):
+    help = "Record a store's orders, products and categories into a gzip NDJSON capture for the replay server"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, required=True, help='ID of the user whose store should be recorded')
+        parser.add_argument('--output', required=True, help='Path of the .ndjson.gz file to write')
+
+    def handle(self, *args, **kwargs):
+        credentials = WooCommerceCredentials.objects.filter(user_id=kwargs['user']).first()
+        if not credentials:
+            raise CommandError('No WooCommerce credentials found for the specified user.')
+
+        def records():
+            for endpoint in ('products/categories', 'products', 'orders'):
+                for page, items in client.iter_pages(endpoint, {'per_page': 100, 'orderby': 'id', 'order': 'asc'}):
+                    self.stdout.write(self.style.NOTICE(f'Recorded {len(items)} {endpoint} from page {page}.'))
+                    for item in items:
+                        yield endpoint, item
+
+        with WooCommerceClient(credentials) as client:
+            try:
+                written = write_capture(kwargs['output'], records())
+            except WooCommerceError as e:
+                raise CommandError(f'Recording aborted: {e}')
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} records to {kwargs['output']}."))
@@ -0,0 +1,157 @@
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.timezone import make_aware
+from orderdata.importer import write_transaction
+from orderdata.jobs import claim_for_user, release_stale_jobs, run_job
+from orderdata.models import Job
+from authentication.models import WooCommerceCredentials, SyncRecord, SyncCheckpoint
+
+class Command(BaseCommand):
+    help = 'Sync every WooCommerce store in a worker pool, polling each one as often as its order volume needs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.SYNC_WORKERS,
+            help='Maximum number of stores synced at the same time',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Sync every store that is due once and exit instead of running forever',
+        )
+
+    def handle(self, *args, **kwargs):
+        workers = max(1, kwargs['workers'])
+        running = {}  # future -> user_id
+
+        self.stdout.write(self.style.NOTICE(f'Starting sync scheduler with {workers} workers...'))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                self.release_stale_jobs()
+                for user_id in self.due_stores(exclude=running.values()):
+                    if len(running) >= workers:
+                        break
+                    running[executor.submit(self.sync_store, user_id)] = user_id
+
+                if not running:
+                    if kwargs['once']:
+                        break
+                    time.sleep(self.seconds_until_next_due())
+                    continue
+
+                done, _ = wait(running, timeout=settings.SYNC_MIN_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    user_id = running.pop(future)
+                    self.report(user_id, future.result())
+
+                if kwargs['once'] and not running and not self.due_stores(exclude=()):
+                    break
+
+        self.stdout.write(self.style.SUCCESS('Sync scheduler finished.'))
+
+    def release_stale_jobs(self):
+        # A scheduler killed mid-sync leaves its job running, which would block the store for good
+        # when no run_workers process is around to release it
+        try:
+            released = release_stale_jobs()
+        except DatabaseError as e:
+            self.stdout.write(self.style.WARNING(f'Could not release stale jobs: {e}'))
+            return
+        if released:
+            self.stdout.write(self.style.WARNING(f'Released {released} stale jobs.'))
+
+    def due_stores(self, exclude):
+        now = timezone.now()
+        credentials = WooCommerceCredentials.objects.exclude(user_id__in=list(exclude)).filter(
+            Q(user__syncrecord__isnull=True)
+            | Q(user__syncrecord__next_sync_time__isnull=True)
+            | Q(user__syncrecord__next_sync_time__lte=now)
+        )
+        return list(credentials.order_by('user__syncrecord__next_sync_time').values_list('user_id', flat=True))
+
+    def seconds_until_next_due(self):
+        next_sync_time = (
+            SyncRecord.objects.filter(user__woocommerce_credentials__isnull=False, next_sync_time__isnull=False)
+            .order_by('next_sync_time').values_list('next_sync_time', flat=True).first()
+        )
+        if next_sync_time is None:
+            return settings.SYNC_MIN_INTERVAL
+        return min(settings.SYNC_MAX_INTERVAL, max(1, (next_sync_time - timezone.now()).total_seconds()))
+
+    def sync_store(self, user_id):
+        # Runs in a worker thread: each store gets its own database connection, and a failure in
+        # one store never reaches the others. The sync is recorded as a running Job, so it never
+        # overlaps a queued import, sync or purge of the same store.
+        close_old_connections()
+        started = time.monotonic()
+        job = error = None
+        try:
+            job = claim_for_user(user_id, Job.KIND_SYNC, f'{socket.gethostname()}:{os.getpid()}:scheduler')
+            if job is None:
+                self.postpone_sync(user_id)
+            else:
+                run_job(job)
+                self.schedule_next_sync(user_id, failed=job.status != Job.STATUS_SUCCEEDED)
+        except Exception as e:
+            # Typically the database being locked by another writer: this store backs off like a
+            # failed sync and the scheduler carries on with the others
+            error = e
+            try:
+                self.schedule_next_sync(user_id, failed=True)
+            except Exception:
+                pass  # Still due, so the next round tries again
+        finally:
+            connections.close_all()
+        return job, time.monotonic() - started, error
+
+    def postpone_sync(self, user_id):
+        # Tries again after the polling floor without touching the store's poll interval
+        next_sync_time = timezone.now() + timedelta(seconds=settings.SYNC_MIN_INTERVAL)
+        with write_transaction():
+            SyncRecord.objects.update_or_create(
+                user_id=user_id,
+                defaults={'next_sync_time': next_sync_time},
+                create_defaults={'last_sync_time': make_aware(datetime(1970, 1, 1)), 'next_sync_time': next_sync_time},
+            )
+
+    def schedule_next_sync(self, user_id, failed):
+        with write_transaction():
+            sync_record, created = SyncRecord.objects.get_or_create(
+                user_id=user_id,
+                defaults={'last_sync_time': make_aware(datetime(1970, 1, 1))}
+            )
+            checkpoint = SyncCheckpoint.objects.filter(user_id=user_id).order_by('-started_at').first()
+            orders = checkpoint.orders_done if checkpoint and not failed else 0
+            sync_record.poll_interval = self.next_poll_interval(sync_record.poll_interval, orders, failed)
+            sync_record.next_sync_time = timezone.now() + timedelta(seconds=sync_record.poll_interval)
+            sync_record.save(update_fields=['poll_interval', 'next_sync_time'])
+
+    def next_poll_interval(self, interval, orders, failed):
+        # Aim for about SYNC_TARGET_ORDERS_PER_POLL changed orders per poll: busy stores are polled
+        # more often, quiet and failing stores back off exponentially.
+        if failed or orders == 0:
+            interval *= 2
+        else:
+            interval = interval * settings.SYNC_TARGET_ORDERS_PER_POLL / orders
+        return int(min(settings.SYNC_MAX_INTERVAL, max(settings.SYNC_MIN_INTERVAL, interval)))
+
+    def report(self, user_id, result):
+        job, elapsed, error = result
+        if error is not None:
+            self.stdout.write(self.style.ERROR(f'Sync for user {user_id} errored after {elapsed:.1f}s: {error!r}'))
+        elif job is None:
+            self.stdout.write(self.style.WARNING(f'Sync for user {user_id} postponed: another job is running.'))
+        elif job.status != Job.STATUS_SUCCEEDED:
+            self.stdout.write(self.style.ERROR(f'Sync for user {user_id} failed after {elapsed:.1f}s: {job.last_error}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Sync for user {user_id} finished in {elapsed:.1f}s.'))
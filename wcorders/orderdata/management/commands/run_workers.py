@@ -0,0 +1,64 @@
+import os
+import socket
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+from orderdata.jobs import claim_next, release_stale_jobs, run_job
+
+class Command(BaseCommand):
+    help = 'Run background sync, import and purge jobs from the database job queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.JOB_WORKERS,
+            help='Number of jobs this process runs at the same time',
+        )
+        parser.add_argument(
+            '--burst',
+            action='store_true',
+            help='Exit once the queue has no runnable jobs instead of polling forever',
+        )
+
+    def handle(self, *args, **kwargs):
+        workers = max(1, kwargs['workers'])
+        self.burst = kwargs['burst']
+        prefix = f'{socket.gethostname()}:{os.getpid()}'
+
+        self.stdout.write(self.style.NOTICE(f'Starting {workers} job workers ({prefix})...'))
+        threads = [
+            threading.Thread(target=self.work, args=(f'{prefix}:{index}',), name=f'job-worker-{index}', daemon=True)
+            for index in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Interrupted; running jobs will be released after JOB_LOCK_TIMEOUT.'))
+            raise
+        self.stdout.write(self.style.SUCCESS('Job workers stopped.'))
+
+    def work(self, worker_id):
+        try:
+            while True:
+                close_old_connections()
+                # Checked on every poll, not just at start-up, so a job left behind by a worker process
+                # that died is picked up by the processes still running
+                release_stale_jobs()
+                job = claim_next(worker_id)
+                if job is None:
+                    if self.burst:
+                        return
+                    time.sleep(settings.JOB_POLL_INTERVAL)
+                    continue
+
+                self.stdout.write(self.style.NOTICE(f'[{worker_id}] Running {job} (attempt {job.attempts})'))
+                run_job(job)
+                self.stdout.write(self.style.NOTICE(f'[{worker_id}] Finished job {job.pk}: {job.status}'))
+        finally:
+            connections.close_all()
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from orderdata.replay import ReplayServer, ReplayStore, generate_synthetic
+
+class Command(BaseCommand):
+    help = 'Serve a local stand-in for the WooCommerce REST API from synthetic data or recorded captures'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--capture', action='append', default=[], help='Gzip NDJSON capture to serve (repeatable)')
+        parser.add_argument('--orders', type=int, default=1000, help='Synthetic orders to generate when no capture is given')
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8008)
+        parser.add_argument('--latency-ms', type=int, default=0, help='Delay added to every response')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+
+    def handle(self, *args, **kwargs):
+        store = ReplayStore()
+        if kwargs['capture']:
+            for path in kwargs['capture']:
+                loaded = store.load_capture(path)
+                self.stdout.write(self.style.NOTICE(f'Loaded {loaded} records from {path}.'))
+        else:
+            generate_synthetic(store, kwargs['orders'], kwargs['products'], kwargs['categories'], kwargs['seed'])
+
+        server = ReplayServer(
+            store, kwargs['host'], kwargs['port'], kwargs['latency_ms'], kwargs['error_rate'], kwargs['seed'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Serving {store.count('orders')} orders, {store.count('products')} products and "
+            f"{store.count('products/categories')} categories at {server.url} (Ctrl-C to stop)."
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        self.stdout.write(self.style.NOTICE(f'Served {server.request_count} requests.'))
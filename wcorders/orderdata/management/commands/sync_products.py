@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from orderdata.importer import sync_catalogue
+from orderdata.woocommerce import WooCommerceClient, WooCommerceError
+from authentication.models import WooCommerceCredentials
+
+class Command(BaseCommand):
+    help = 'Sync products and categories changed in WooCommerce since the last catalogue sync'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, required=True, help='ID of the user whose catalogue should be synced')
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            help="Maximum number of product pages fetched in parallel (defaults to the store's max_concurrency)",
+        )
+
+    def handle(self, *args, **kwargs):
+        credentials = WooCommerceCredentials.objects.filter(user_id=kwargs['user']).first()
+        if not credentials:
+            self.stdout.write(self.style.ERROR('No WooCommerce credentials found for the specified user.'))
+            return
+
+        with WooCommerceClient(credentials) as client:
+            try:
+                synced = sync_catalogue(client, credentials.user, kwargs.get('concurrency'))
+            except WooCommerceError as e:
+                raise CommandError(f'Product sync aborted: {e}')
+
+        self.stdout.write(self.style.SUCCESS(f'Synced {synced} products.'))
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 06:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orderdata", "0007_alter_category_name"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="woocommerceorder",
+            name="payload_hash",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
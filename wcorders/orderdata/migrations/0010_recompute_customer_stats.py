@@ -0,0 +1,27 @@
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def recompute_customer_stats(apps, schema_editor):
+    # Earlier imports added every re-synced order to the totals again; derive them from the orders instead
+    Customer = apps.get_model("orderdata", "Customer")
+    WooCommerceOrder = apps.get_model("orderdata", "WooCommerceOrder")
+    orders = WooCommerceOrder.objects.filter(customer=OuterRef("pk")).order_by().values("customer")
+    Customer.objects.update(
+        total_spent=Coalesce(Subquery(orders.annotate(total_spent=Sum("total")).values("total_spent")), Decimal(0)),
+        orders_count=Coalesce(Subquery(orders.annotate(orders_count=Count("pk")).values("orders_count")), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orderdata", "0009_job"),
+    ]
+
+    operations = [
+        migrations.RunPython(recompute_customer_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.0.6 on 2026-10-18 06:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orderdata", "0010_recompute_customer_stats"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OrderArchive",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("order_id", models.BigIntegerField()),
+                ("date_modified", models.DateTimeField()),
+                ("payload", models.BinaryField()),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="orderarchive",
+            constraint=models.UniqueConstraint(
+                fields=("user", "order_id", "date_modified"),
+                name="unique_order_archive_version",
+            ),
+        ),
+    ]
@@ -0,0 +1,57 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orderdata", "0011_orderarchive"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="address",
+            name="address_hash",
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name="customer",
+            name="billing_address",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="orderdata.address",
+            ),
+        ),
+        migrations.AddField(
+            model_name="customer",
+            name="shipping_address",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="orderdata.address",
+            ),
+        ),
+        migrations.AddField(
+            model_name="woocommerceorder",
+            name="billing_address",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="orderdata.address",
+            ),
+        ),
+        migrations.AddField(
+            model_name="woocommerceorder",
+            name="shipping_address",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="orderdata.address",
+            ),
+        ),
+    ]
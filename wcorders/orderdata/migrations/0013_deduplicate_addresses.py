@@ -0,0 +1,79 @@
+import hashlib
+import json
+from collections import defaultdict
+
+from django.db import migrations
+
+CHUNK_SIZE = 2000
+
+
+def address_digest(address):
+    # Must match orderdata.importer.address_digest
+    return hashlib.sha256(
+        json.dumps(address, sort_keys=True, separators=(",", ":")).encode()
+    ).hexdigest()
+
+
+def deduplicate_addresses(apps, schema_editor):
+    # Points every order and customer at the first row holding each distinct address, then drops the copies
+    Address = apps.get_model("orderdata", "Address")
+    Customer = apps.get_model("orderdata", "Customer")
+    WooCommerceOrder = apps.get_model("orderdata", "WooCommerceOrder")
+
+    canonical = {}  # digest -> pk of the row that is kept
+    latest = defaultdict(
+        dict
+    )  # customer pk -> address_type -> address pk, the highest row wins
+    last_pk = 0
+    while True:
+        rows = list(
+            Address.objects.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .values_list("pk", "order_id", "customer_id", "address_type", "address")[
+                :CHUNK_SIZE
+            ]
+        )
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+
+        kept = []
+        orders = defaultdict(list)  # (address_type, address pk) -> order pks
+        for pk, order_id, customer_id, address_type, address in rows:
+            digest = address_digest(address)
+            if digest not in canonical:
+                canonical[digest] = pk
+                kept.append(Address(pk=pk, address_hash=digest))
+            orders[address_type, canonical[digest]].append(order_id)
+            latest[customer_id][address_type] = canonical[digest]
+
+        Address.objects.bulk_update(kept, ["address_hash"])
+        for (address_type, address_pk), order_ids in orders.items():
+            if address_type in ("billing", "shipping"):
+                WooCommerceOrder.objects.filter(pk__in=order_ids).update(
+                    **{f"{address_type}_address": address_pk}
+                )
+
+    customers = defaultdict(list)
+    for customer_id, addresses in latest.items():
+        customers[addresses.get("billing"), addresses.get("shipping")].append(
+            customer_id
+        )
+    for (billing_pk, shipping_pk), customer_ids in customers.items():
+        for start in range(0, len(customer_ids), CHUNK_SIZE):
+            Customer.objects.filter(
+                pk__in=customer_ids[start : start + CHUNK_SIZE]
+            ).update(billing_address=billing_pk, shipping_address=shipping_pk)
+
+    Address.objects.filter(address_hash__isnull=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orderdata", "0012_address_hash_and_links"),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_addresses, migrations.RunPython.noop),
+    ]
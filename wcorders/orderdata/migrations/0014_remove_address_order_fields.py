@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orderdata", "0013_deduplicate_addresses"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="address",
+            name="address_type",
+        ),
+        migrations.RemoveField(
+            model_name="address",
+            name="customer",
+        ),
+        migrations.RemoveField(
+            model_name="address",
+            name="order",
+        ),
+        migrations.AlterField(
+            model_name="address",
+            name="address_hash",
+            field=models.CharField(max_length=64, unique=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-18 06:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orderdata", "0014_remove_address_order_fields"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="orderitem",
+            name="wc_product_id",
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="orderitem",
+            name="wc_variation_id",
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
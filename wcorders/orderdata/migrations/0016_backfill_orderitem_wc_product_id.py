@@ -0,0 +1,25 @@
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_wc_product_id(apps, schema_editor):
+    # Linked items know their WooCommerce product through the FK; unlinked ones lost it and get
+    # it back the next time their order is re-synced or rebuilt from the archive
+    OrderItem = apps.get_model("orderdata", "OrderItem")
+    Product = apps.get_model("orderdata", "Product")
+    OrderItem.objects.filter(product__isnull=False).update(
+        wc_product_id=Subquery(
+            Product.objects.filter(pk=OuterRef("product_id")).values("product_id")[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orderdata", "0015_orderitem_wc_product_id"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_wc_product_id, migrations.RunPython.noop),
+    ]
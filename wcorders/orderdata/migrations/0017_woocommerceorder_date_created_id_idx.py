@@ -0,0 +1,21 @@
+# Generated by Django 5.0.6 on 2026-10-18 06:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orderdata", "0016_backfill_orderitem_wc_product_id"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="woocommerceorder",
+            index=models.Index(
+                fields=["date_created", "id"], name="order_date_created_id_idx"
+            ),
+        ),
+    ]
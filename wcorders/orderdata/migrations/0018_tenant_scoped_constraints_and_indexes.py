@@ -0,0 +1,67 @@
+# Generated by Django 5.0.6 on 2026-10-18 06:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orderdata", "0017_woocommerceorder_date_created_id_idx"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="woocommerceorder",
+            name="order_date_created_id_idx",
+        ),
+        migrations.AlterField(
+            model_name="customer",
+            name="email",
+            field=models.EmailField(max_length=254),
+        ),
+        migrations.AlterField(
+            model_name="woocommerceorder",
+            name="order_id",
+            field=models.BigIntegerField(),
+        ),
+        migrations.AddIndex(
+            model_name="orderitem",
+            index=models.Index(
+                fields=["order", "product"], name="orderitem_order_product_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="woocommerceorder",
+            index=models.Index(
+                fields=["user", "date_created", "id"],
+                name="order_user_date_created_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="woocommerceorder",
+            index=models.Index(
+                fields=["user", "status", "date_created"],
+                name="order_user_status_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="woocommerceorder",
+            index=models.Index(
+                fields=["customer", "date_created"], name="order_customer_date_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="customer",
+            constraint=models.UniqueConstraint(
+                fields=("user", "email"), name="unique_customer_email_per_user"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="woocommerceorder",
+            constraint=models.UniqueConstraint(
+                fields=("user", "order_id"), name="unique_order_id_per_user"
+            ),
+        ),
+    ]
@@ -0,0 +1,86 @@
+from django.db import migrations
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce, TruncDate
+
+# Must match orderdata.analytics.REVENUE_STATUSES
+REVENUE_STATUSES = ["completed", "processing", "on-hold", "refunded"]
+
+
+def populate_rollups(apps, schema_editor):
+    # Same grouped queries as orderdata.rollups.aggregate_days, run once per existing tenant
+    WooCommerceOrder = apps.get_model("orderdata", "WooCommerceOrder")
+    OrderItem = apps.get_model("orderdata", "OrderItem")
+    DailySales = apps.get_model("orderdata", "DailySales")
+    DailyProductSales = apps.get_model("orderdata", "DailyProductSales")
+    children = [
+        (OrderItem, "quantity", "items"),
+        (apps.get_model("orderdata", "Tax"), "total", "tax"),
+        (apps.get_model("orderdata", "ShippingMethod"), "total", "shipping"),
+        (apps.get_model("orderdata", "Coupon"), "discount", "discounts"),
+    ]
+
+    user_ids = WooCommerceOrder.objects.values_list("user_id", flat=True).distinct()
+    for user_id in user_ids:
+        orders = WooCommerceOrder.objects.filter(
+            user_id=user_id, status__in=REVENUE_STATUSES
+        )
+        daily = {}
+        for row in (
+            orders.annotate(day=TruncDate("date_created"))
+            .values("day")
+            .annotate(
+                orders=Count("id"), revenue=Sum("total"), refunds=Sum("refund_amount")
+            )
+        ):
+            daily[row["day"]] = DailySales(
+                user_id=user_id,
+                date=row["day"],
+                orders=row["orders"],
+                revenue=row["revenue"],
+                refunds=row["refunds"],
+            )
+        for model, value, field in children:
+            for row in (
+                model.objects.filter(order__in=orders)
+                .annotate(day=TruncDate("order__date_created"))
+                .values("day")
+                .annotate(value=Sum(value))
+            ):
+                setattr(daily[row["day"]], field, row["value"] or 0)
+        DailySales.objects.bulk_create(daily.values(), batch_size=1000)
+
+        DailyProductSales.objects.bulk_create(
+            (
+                DailyProductSales(
+                    user_id=user_id,
+                    date=row["day"],
+                    wc_product_id=row["wc_product"],
+                    orders=row["orders"],
+                    quantity=row["quantity"],
+                    revenue=row["revenue"],
+                )
+                for row in OrderItem.objects.filter(order__in=orders)
+                .annotate(
+                    day=TruncDate("order__date_created"),
+                    wc_product=Coalesce("wc_product_id", 0),
+                )
+                .values("day", "wc_product")
+                .annotate(
+                    orders=Count("order", distinct=True),
+                    quantity=Sum("quantity"),
+                    revenue=Sum("total"),
+                )
+            ),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orderdata", "0019_daily_rollups"),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
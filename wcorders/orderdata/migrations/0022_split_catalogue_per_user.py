@@ -0,0 +1,68 @@
+from collections import defaultdict
+
+from django.db import migrations
+
+
+def split_catalogue(apps, schema_editor):
+    # Gives every store its own copy of the products and categories its line items use: the first
+    # store keeps the existing row, the others get copies and their items are repointed. Rows no
+    # order references cannot be attributed and are dropped, and every catalogue watermark is reset
+    # so the next sync refetches each store's own names, prices and unsold products.
+    Category = apps.get_model("orderdata", "Category")
+    Product = apps.get_model("orderdata", "Product")
+    OrderItem = apps.get_model("orderdata", "OrderItem")
+    SyncRecord = apps.get_model("authentication", "SyncRecord")
+
+    owners = defaultdict(set)  # product pk -> user ids whose items use it
+    for product_pk, user_id in (
+        OrderItem.objects.filter(product__isnull=False)
+        .values_list("product_id", "order__user_id")
+        .distinct()
+    ):
+        owners[product_pk].add(user_id)
+
+    categories = {}  # (category pk, user id) -> pk of that user's category row
+    claimed = set()  # category pks already given to a user
+
+    def category_for(category_pk, user_id):
+        if category_pk is None:
+            return None
+        if (category_pk, user_id) not in categories:
+            category = Category.objects.get(pk=category_pk)
+            if category_pk in claimed:
+                category.pk = None
+            claimed.add(category_pk)
+            category.user_id = user_id
+            category.save()
+            categories[category_pk, user_id] = category.pk
+        return categories[category_pk, user_id]
+
+    for product in Product.objects.filter(pk__in=list(owners)).order_by("pk"):
+        original_pk, original_category = product.pk, product.category_id
+        for index, user_id in enumerate(sorted(owners[original_pk])):
+            product.user_id = user_id
+            product.category_id = category_for(original_category, user_id)
+            if index:
+                product.pk = None
+                product.save()
+                OrderItem.objects.filter(
+                    product_id=original_pk, order__user_id=user_id
+                ).update(product_id=product.pk)
+            else:
+                product.save()
+
+    Product.objects.filter(user__isnull=True).delete()
+    Category.objects.filter(user__isnull=True).delete()
+    SyncRecord.objects.update(catalogue_sync_time=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orderdata", "0021_catalogue_user"),
+        ("authentication", "0007_syncrecord_catalogue_sync_time"),
+    ]
+
+    operations = [
+        migrations.RunPython(split_catalogue, migrations.RunPython.noop),
+    ]
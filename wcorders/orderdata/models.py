@@ -3,34 +3,56 @@ from django.contrib.auth.models import User
 
 class Customer(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='customers')
-    email = models.EmailField(unique=True)
+    email = models.EmailField()
     first_name = models.CharField(max_length=255)
     last_name = models.CharField(max_length=255)
     total_spent = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     orders_count = models.IntegerField(default=0)
+    # Addresses from the customer's most recently imported order
+    billing_address = models.ForeignKey('Address', on_delete=models.SET_NULL, null=True, related_name='+')
+    shipping_address = models.ForeignKey('Address', on_delete=models.SET_NULL, null=True, related_name='+')
+
+    class Meta:
+        constraints = [
+            # Stores are separate tenants, so the same shopper can be a customer of several of them
+            models.UniqueConstraint(fields=['user', 'email'], name='unique_customer_email_per_user'),
+        ]
 
     def __str__(self):
         return f"{self.email} - {self.first_name} {self.last_name}"
 
 class Category(models.Model):
-    category_id = models.BigIntegerField(unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    category_id = models.BigIntegerField()
     name = models.CharField(max_length=255)
 
+    class Meta:
+        constraints = [
+            # WooCommerce category and product IDs are post IDs of one store
+            models.UniqueConstraint(fields=['user', 'category_id'], name='unique_category_id_per_user'),
+        ]
+
     def __str__(self):
         return self.name
 
 class Product(models.Model):
-    product_id = models.BigIntegerField(unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    product_id = models.BigIntegerField()
     name = models.CharField(max_length=255)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product_id'], name='unique_product_id_per_user'),
+        ]
+
     def __str__(self):
         return self.name
 
 class WooCommerceOrder(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    order_id = models.BigIntegerField(unique=True)
+    order_id = models.BigIntegerField()
     status = models.CharField(max_length=50)
     total = models.DecimalField(max_digits=10, decimal_places=2)
     date_created = models.DateTimeField()
@@ -38,27 +60,49 @@ class WooCommerceOrder(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True)
     refund_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     payment_gateway = models.ForeignKey('PaymentGateway', on_delete=models.SET_NULL, null=True)
+    payload_hash = models.CharField(max_length=64, blank=True, default='')  # SHA-256 of the normalized API payload
+    billing_address = models.ForeignKey('Address', on_delete=models.SET_NULL, null=True, related_name='+')
+    shipping_address = models.ForeignKey('Address', on_delete=models.SET_NULL, null=True, related_name='+')
+
+    class Meta:
+        constraints = [
+            # WooCommerce order IDs are only unique within one store
+            models.UniqueConstraint(fields=['user', 'order_id'], name='unique_order_id_per_user'),
+        ]
+        # Every user-facing query is scoped to one tenant, so the tenant leads each index
+        indexes = [
+            models.Index(fields=['user', 'date_created', 'id'], name='order_user_date_created_idx'),
+            models.Index(fields=['user', 'status', 'date_created'], name='order_user_status_date_idx'),
+            models.Index(fields=['customer', 'date_created'], name='order_customer_date_idx'),
+        ]
 
     def __str__(self):
         return f"Order {self.order_id}"
 
 class OrderItem(models.Model):
     order = models.ForeignKey(WooCommerceOrder, on_delete=models.CASCADE, related_name='items')
-    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)  # Linked by link_order_item_products
+    wc_product_id = models.BigIntegerField(null=True)  # WooCommerce product ID, kept until the product is imported
+    wc_variation_id = models.BigIntegerField(default=0)
     quantity = models.IntegerField()
     total = models.DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['order', 'product'], name='orderitem_order_product_idx'),
+        ]
+
     def __str__(self):
-        return f"Item {self.product.name} in Order {self.order.order_id}"
+        name = self.product.name if self.product else f"product {self.wc_product_id}"
+        return f"Item {name} in Order {self.order.order_id}"
 
 class Address(models.Model):
-    order = models.ForeignKey(WooCommerceOrder, on_delete=models.CASCADE)
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
-    address_type = models.CharField(max_length=10)  # 'billing' or 'shipping'
+    # Content-addressed: each distinct address is stored once and shared by every order and customer using it
+    address_hash = models.CharField(max_length=64, unique=True)  # SHA-256 of the canonical JSON
     address = models.JSONField()
 
     def __str__(self):
-        return f"{self.address_type.capitalize()} Address for Order {self.order.order_id}"
+        return ', '.join(str(value) for value in self.address.values() if value) or self.address_hash
 
 
 class PaymentGateway(models.Model):
@@ -97,3 +141,117 @@ class Tax(models.Model):
 
     def __str__(self):
         return f"Tax {self.total} for Order {self.order.order_id}"
+
+class OrderArchive(models.Model):
+    # Raw order payloads as received from WooCommerce, one row per order version, so the
+    # mapping can be re-run locally (rebuild_from_archive) without refetching the history
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    order_id = models.BigIntegerField()
+    date_modified = models.DateTimeField()
+    payload = models.BinaryField()  # zlib-compressed JSON
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'order_id', 'date_modified'], name='unique_order_archive_version'),
+        ]
+
+    def __str__(self):
+        return f"Archived order {self.order_id} modified {self.date_modified}"
+
+class DailySales(models.Model):
+    # Per-tenant daily totals of revenue-status orders (see analytics.REVENUE_STATUSES), kept up to
+    # date for the days each write touches by the importer, webhook deletes and the order endpoints,
+    # and rebuilt by rebuild_rollups
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    date = models.DateField()  # In settings.TIME_ZONE
+    orders = models.IntegerField(default=0)
+    items = models.IntegerField(default=0)  # Units sold
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    refunds = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    tax = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    shipping = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    discounts = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date'], name='unique_daily_sales_per_user'),
+        ]
+
+    def __str__(self):
+        return f"Sales on {self.date}"
+
+class DailyProductSales(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    date = models.DateField()  # In settings.TIME_ZONE
+    wc_product_id = models.BigIntegerField()  # Matches Product.product_id; 0 for custom line items
+    orders = models.IntegerField(default=0)
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'date', 'wc_product_id'], name='unique_daily_product_sales_per_user',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Product {self.wc_product_id} sales on {self.date}"
+
+class Job(models.Model):
+    # Background ingestion work, claimed by `run_workers` processes straight from this table
+    KIND_SYNC = 'sync'
+    KIND_IMPORT = 'import'
+    KIND_PURGE = 'purge'
+    KIND_CHOICES = [
+        (KIND_SYNC, 'Sync orders'),
+        (KIND_IMPORT, 'First import'),
+        (KIND_PURGE, 'Delete all orders'),
+    ]
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='jobs')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    run_after = models.DateTimeField(auto_now_add=True)  # Pushed back when a failed job is retried
+    locked_by = models.CharField(max_length=255, blank=True)  # Worker that claimed the job
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    output = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+        constraints = [
+            # Repeated triggers for the same store coalesce into one pending job per kind
+            models.UniqueConstraint(
+                fields=['user', 'kind'],
+                condition=models.Q(status='pending'),
+                name='unique_pending_job_per_user_kind',
+            ),
+            # Never run two jobs for the same user at once
+            models.UniqueConstraint(
+                fields=['user'],
+                condition=models.Q(status='running'),
+                name='unique_running_job_per_user',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} for {self.user.username} ({self.status})"
@@ -0,0 +1,56 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    # Keyset pagination: the cursor encodes the last row's position, so every page is an indexed
+    # range scan with a LIMIT and no COUNT(*), however deep the client pages
+    ordering = '-id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class OrderCursorPagination(IdCursorPagination):
+    # Newest orders first; backed by the (date_created, id) index on WooCommerceOrder
+    ordering = ('-date_created', '-id')
+
+
+class LeaderboardPagination(IdCursorPagination):
+    # Keyset pagination over grouped rows ranked by (-metric, key), where `key` is unique per row.
+    # The cursor holds the last row's metric and key and the next page keeps the rows ranked after
+    # it with a HAVING clause, so ties never fall back to offsets. Forward only: a leaderboard is
+    # read from the top. The view sets `ordering` to (metric, key) before paginating.
+    page_size = 20
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        metric, key = view.ordering
+
+        queryset = queryset.order_by(f'-{metric}', key)
+        if self.cursor is not None:
+            try:
+                value, last_key = self.cursor.position.split(',')
+                value, last_key = Decimal(value), int(last_key)
+            except (AttributeError, ValueError, InvalidOperation):
+                raise NotFound(self.invalid_cursor_message)
+            queryset = queryset.filter(Q(**{f'{metric}__lt': value}) | Q(**{metric: value, f'{key}__gt': last_key}))
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        self.has_next = len(results) > self.page_size
+        self.has_previous = False
+        if self.has_next:
+            self.next_position = f'{self.page[-1][metric]},{self.page[-1][key]}'
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self.next_position))
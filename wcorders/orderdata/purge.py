@@ -0,0 +1,112 @@
+import logging
+
+from django.db import connection
+
+from authentication.models import SyncRecord
+
+from .importer import write_transaction
+from .models import (
+    WooCommerceOrder, OrderItem, Address, ShippingMethod, Coupon, Tax, Customer, PaymentGateway, Product, Category,
+    OrderArchive, DailySales, DailyProductSales,
+)
+
+logger = logging.getLogger(__name__)
+
+# Tables hanging off an order, deleted before the order rows themselves
+ORDER_CHILDREN = [OrderItem, ShippingMethod, Coupon, Tax]
+
+
+def table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def delete_in_chunks(model, where, params, chunk_size, children=()):
+    # Deletes `model` rows matching `where` in primary-key order, `chunk_size` at a time, with plain
+    # DELETE statements instead of the ORM collector. `children` lists (model, column) pairs whose rows
+    # point at the chunk and must go first. Every chunk is its own transaction so the write lock is
+    # released in between. Yields the running total after each chunk.
+    deleted = 0
+    while True:
+        with write_transaction(), connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT id FROM {table(model)} WHERE {where} ORDER BY id LIMIT %s', [*params, chunk_size]
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                return
+            for child, column in children:
+                cursor.execute(
+                    f'DELETE FROM {table(child)} WHERE {connection.ops.quote_name(column)} IN ({placeholders(ids)})', ids
+                )
+            cursor.execute(f'DELETE FROM {table(model)} WHERE id IN ({placeholders(ids)})', ids)
+        deleted += len(ids)
+        yield deleted
+
+
+def delete_unreferenced(model, candidate_ids, references, chunk_size):
+    # For rows shared between tenants, such as addresses: a candidate only goes if none of the
+    # (model, column) `references` points at it any more
+    not_exists = ' AND '.join(
+        f'NOT EXISTS (SELECT 1 FROM {table(other)} WHERE {connection.ops.quote_name(column)} = {table(model)}.id)'
+        for other, column in references
+    )
+    deleted = 0
+    candidate_ids = sorted(candidate_ids)
+    for start in range(0, len(candidate_ids), chunk_size):
+        ids = candidate_ids[start:start + chunk_size]
+        with write_transaction(), connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table(model)} WHERE id IN ({placeholders(ids)}) AND {not_exists}', ids)
+            deleted += cursor.rowcount
+    return deleted
+
+
+def purge_user(user, chunk_size=1000, progress=None):
+    # Removes a tenant's orders and everything derived from them. `progress(stage, done, total)` is
+    # called after every chunk.
+    progress = progress or (lambda stage, done, total: None)
+    orders = WooCommerceOrder.objects.filter(user=user)
+    total = orders.count()
+
+    # Addresses are shared between stores; the ones this tenant used are candidates for cleanup
+    address_ids = set()
+    for queryset in (orders, Customer.objects.filter(user=user)):
+        for billing_id, shipping_id in queryset.values_list('billing_address_id', 'shipping_address_id').iterator():
+            address_ids.update((billing_id, shipping_id))
+    address_ids.discard(None)
+
+    counts = {'orders': 0}
+    children = [(child, 'order_id') for child in ORDER_CHILDREN]
+    for done in delete_in_chunks(WooCommerceOrder, 'user_id = %s', [user.pk], chunk_size, children):
+        counts['orders'] = done
+        progress('orders', done, total)
+
+    for model, children in (
+        (Customer, []),
+        (PaymentGateway, []),
+        (OrderArchive, []),
+        (DailySales, []),
+        (DailyProductSales, []),
+        # The catalogue is per store; its order items are already gone and products go before categories
+        (Product, []),
+        (Category, []),
+    ):
+        key = model._meta.verbose_name_plural
+        counts[key] = 0
+        for done in delete_in_chunks(model, 'user_id = %s', [user.pk], chunk_size, children):
+            counts[key] = done
+            progress(key, done, None)
+
+    counts['addresses'] = delete_unreferenced(Address, address_ids, [
+        (WooCommerceOrder, 'billing_address_id'),
+        (WooCommerceOrder, 'shipping_address_id'),
+        (Customer, 'billing_address_id'),
+        (Customer, 'shipping_address_id'),
+    ], chunk_size)
+    # The catalogue is gone, so the next catalogue sync starts from scratch
+    SyncRecord.objects.filter(user=user).update(catalogue_sync_time=None)
+    logger.info("Purged %s: %s", user, counts)
+    return counts
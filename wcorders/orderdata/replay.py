@@ -0,0 +1,213 @@
+import gzip
+import json
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+API_PREFIX = '/wp-json/wc/v3/'
+ENDPOINTS = ('orders', 'products', 'products/categories')
+MAX_PER_PAGE = 100
+
+
+class ReplayStore:
+    # In-memory stand-in for a store's catalogue and order history, keyed by endpoint and id
+
+    def __init__(self):
+        self.items = {endpoint: {} for endpoint in ENDPOINTS}
+        self.lock = threading.Lock()
+
+    def add(self, endpoint, item):
+        with self.lock:
+            self.items[endpoint][item['id']] = item
+
+    def count(self, endpoint):
+        return len(self.items[endpoint])
+
+    def query(self, endpoint, params):
+        with self.lock:
+            rows = list(self.items[endpoint].values())
+
+        if 'include' in params:
+            include = {int(value) for value in params['include'].split(',') if value}
+            rows = [row for row in rows if row['id'] in include]
+        field = 'date_modified_gmt' if params.get('dates_are_gmt') == 'true' else 'date_modified'
+        if 'modified_after' in params:
+            rows = [row for row in rows if row.get(field, '') > params['modified_after']]
+        if 'modified_before' in params:
+            rows = [row for row in rows if row.get(field, '') < params['modified_before']]
+
+        orderby = {'modified': 'date_modified_gmt', 'date': 'date_created_gmt'}.get(params.get('orderby'), 'id')
+        rows.sort(key=lambda row: (row.get(orderby) or '', row['id']), reverse=params.get('order') == 'desc')
+
+        per_page = min(int(params.get('per_page', 10)), MAX_PER_PAGE)
+        page = int(params.get('page', 1))
+        total_pages = (len(rows) + per_page - 1) // per_page
+        return rows[(page - 1) * per_page:page * per_page], len(rows), total_pages
+
+    def touch_orders(self, fraction, seed=0):
+        # Simulates store activity: re-stamps a fraction of the orders as modified now
+        rng = random.Random(seed)
+        now = datetime.utcnow().replace(microsecond=0)
+        touched = 0
+        with self.lock:
+            for order in self.items['orders'].values():
+                if rng.random() < fraction:
+                    order['status'] = rng.choice(['completed', 'processing', 'refunded'])
+                    order['date_modified'] = order['date_modified_gmt'] = now.isoformat()
+                    touched += 1
+        return touched
+
+    def load_capture(self, path):
+        # Captures are gzip-compressed NDJSON: one {"endpoint": ..., "data": {...}} object per line
+        loaded = 0
+        with gzip.open(path, 'rt', encoding='utf-8') as capture:
+            for line in capture:
+                if line.strip():
+                    record = json.loads(line)
+                    self.add(record['endpoint'], record['data'])
+                    loaded += 1
+        return loaded
+
+
+def write_capture(path, records):
+    # `records` yields (endpoint, item) pairs
+    written = 0
+    with gzip.open(path, 'wt', encoding='utf-8') as capture:
+        for endpoint, item in records:
+            capture.write(json.dumps({'endpoint': endpoint, 'data': item}, separators=(',', ':')))
+            capture.write('\n')
+            written += 1
+    return written
+
+
+def generate_synthetic(store, orders, products=500, categories=20, seed=0):
+    rng = random.Random(seed)
+    start = datetime(2022, 1, 1)
+
+    for category_id in range(1, categories + 1):
+        store.add('products/categories', {'id': category_id, 'name': f'Category {category_id}', 'slug': f'category-{category_id}'})
+
+    catalogue = []
+    for product_id in range(1, products + 1):
+        category_id = rng.randint(1, categories)
+        product = {
+            'id': product_id,
+            'name': f'Product {product_id}',
+            'price': f'{rng.randint(100, 20000) / 100:.2f}',
+            'categories': [{'id': category_id, 'name': f'Category {category_id}', 'slug': f'category-{category_id}'}],
+            'date_modified': (start + timedelta(minutes=product_id)).isoformat(),
+            'date_modified_gmt': (start + timedelta(minutes=product_id)).isoformat(),
+        }
+        store.add('products', product)
+        catalogue.append(product)
+
+    customers = max(1, orders // 4)
+    for order_id in range(1, orders + 1):
+        created = start + timedelta(minutes=order_id * 7 + rng.randint(0, 6))
+        customer = rng.randint(1, customers)
+        address = {
+            'first_name': f'First{customer}',
+            'last_name': f'Last{customer}',
+            'address_1': f'{customer} High Street',
+            'city': 'London',
+            'postcode': f'N{customer % 20} 1AA',
+            'country': 'GB',
+        }
+        line_items = []
+        for _ in range(rng.choice([1, 1, 2, 3, 5])):
+            product = rng.choice(catalogue)
+            quantity = rng.randint(1, 3)
+            line_items.append({
+                'product_id': product['id'],
+                'variation_id': 0,
+                'name': product['name'],
+                'quantity': quantity,
+                'price': product['price'],
+                'total': f"{float(product['price']) * quantity:.2f}",
+            })
+        shipping_total = rng.choice([0, 4.99, 9.99])
+        items_total = sum(float(item['total']) for item in line_items)
+        tax_total = round(items_total * 0.2, 2)
+        coupon_lines = [{'code': 'SAVE10', 'discount': f'{items_total * 0.1:.2f}'}] if rng.random() < 0.15 else []
+        store.add('orders', {
+            'id': order_id,
+            'status': rng.choice(['completed'] * 8 + ['processing', 'refunded']),
+            'total': f'{items_total + shipping_total + tax_total:.2f}',
+            'date_created': created.isoformat(),
+            'date_created_gmt': created.isoformat(),
+            'date_modified': created.isoformat(),
+            'date_modified_gmt': created.isoformat(),
+            'payment_method': rng.choice(['stripe', 'paypal', 'bacs']),
+            'billing': {**address, 'email': f'customer{customer}@example.com', 'phone': '0123456789'},
+            'shipping': address,
+            'line_items': line_items,
+            'shipping_lines': [{'method_id': 'flat_rate', 'method_title': 'Flat rate', 'total': f'{shipping_total:.2f}'}],
+            'coupon_lines': coupon_lines,
+            'tax_lines': [{'label': 'VAT', 'rate': '20', 'total': f'{tax_total:.2f}'}],
+            'refunds': [],
+        })
+    return store
+
+
+class ReplayRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def do_GET(self):
+        server = self.server
+        with server.stats_lock:
+            server.request_count += 1
+
+        url = urlparse(self.path)
+        endpoint = url.path[len(API_PREFIX):].strip('/') if url.path.startswith(API_PREFIX) else None
+        if endpoint not in ENDPOINTS:
+            return self.send_json(404, {'code': 'rest_no_route', 'message': 'No route was found.'})
+
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and server.random.random() < server.error_rate:
+            return self.send_json(503, {'code': 'unavailable', 'message': 'Injected failure.'})
+
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        rows, total, total_pages = server.store.query(endpoint, params)
+        self.send_json(200, rows, {'X-WP-Total': total, 'X-WP-TotalPages': total_pages})
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ReplayServer(ThreadingHTTPServer):
+    # Serves a ReplayStore with WooCommerce REST pagination headers, optional latency and injected 503s
+    daemon_threads = True
+
+    def __init__(self, store, host='127.0.0.1', port=0, latency_ms=0, error_rate=0.0, seed=0):
+        super().__init__((host, port), ReplayRequestHandler)
+        self.store = store
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.request_count = 0
+        self.stats_lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='woocommerce-replay', daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,99 @@
+import logging
+from datetime import datetime, time, timedelta
+from functools import reduce
+from operator import or_
+
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .analytics import REVENUE_STATUSES
+from .models import (
+    WooCommerceOrder, OrderItem, ShippingMethod, Coupon, Tax, DailySales, DailyProductSales,
+)
+
+logger = logging.getLogger(__name__)
+
+# Days per statement when refreshing scattered days, to keep the OR of date ranges bounded
+DAYS_PER_QUERY = 100
+
+
+def local_date(value):
+    return timezone.localtime(value).date()
+
+
+def day_ranges(days):
+    # Each day as a [midnight, next midnight) range in the current time zone, so the filter can use
+    # the (user, status, date_created) index instead of computing a date per row
+    ranges = []
+    for day in sorted(days):
+        start = timezone.make_aware(datetime.combine(day, time.min))
+        ranges.append(Q(date_created__gte=start, date_created__lt=start + timedelta(days=1)))
+    return reduce(or_, ranges)
+
+
+def aggregate_days(user, days=None):
+    # Grouped queries over the raw tables for the given days, or every day when `days` is None.
+    # Returns ({date: DailySales}, {(date, wc_product_id): DailyProductSales}).
+    orders = WooCommerceOrder.objects.filter(user=user, status__in=REVENUE_STATUSES)
+    if days is not None:
+        orders = orders.filter(day_ranges(days))
+
+    daily = {}
+    for row in (
+        orders.annotate(day=TruncDate('date_created')).values('day')
+        .annotate(orders=Count('id'), revenue=Sum('total'), refunds=Sum('refund_amount'))
+    ):
+        daily[row['day']] = DailySales(
+            user=user, date=row['day'], orders=row['orders'], revenue=row['revenue'], refunds=row['refunds'],
+        )
+
+    # Children are grouped by their order's day; the order filter becomes a subquery on the same index
+    for model, value, field in (
+        (OrderItem, 'quantity', 'items'),
+        (Tax, 'total', 'tax'),
+        (ShippingMethod, 'total', 'shipping'),
+        (Coupon, 'discount', 'discounts'),
+    ):
+        for row in (
+            model.objects.filter(order__in=orders).annotate(day=TruncDate('order__date_created')).values('day')
+            .annotate(value=Sum(value))
+        ):
+            setattr(daily[row['day']], field, row['value'] or 0)
+
+    products = {}
+    for row in (
+        OrderItem.objects.filter(order__in=orders)
+        .annotate(day=TruncDate('order__date_created'), wc_product=Coalesce('wc_product_id', 0))
+        .values('day', 'wc_product')
+        .annotate(orders=Count('order', distinct=True), quantity=Sum('quantity'), revenue=Sum('total'))
+    ):
+        products[row['day'], row['wc_product']] = DailyProductSales(
+            user=user, date=row['day'], wc_product_id=row['wc_product'],
+            orders=row['orders'], quantity=row['quantity'], revenue=row['revenue'],
+        )
+    return daily, products
+
+
+def refresh_daily_rollups(user, days):
+    # Recomputes the rollup rows of the given days from the raw tables; days without revenue
+    # orders lose their rows. Call inside write_transaction so readers never see a half-written day.
+    days = sorted(set(days))
+    for start in range(0, len(days), DAYS_PER_QUERY):
+        batch = days[start:start + DAYS_PER_QUERY]
+        daily, products = aggregate_days(user, batch)
+        DailySales.objects.filter(user=user, date__in=batch).delete()
+        DailyProductSales.objects.filter(user=user, date__in=batch).delete()
+        DailySales.objects.bulk_create(daily.values())
+        DailyProductSales.objects.bulk_create(products.values())
+
+
+def rebuild_daily_rollups(user):
+    # Regenerates every rollup row of a tenant from scratch
+    daily, products = aggregate_days(user)
+    DailySales.objects.filter(user=user).delete()
+    DailyProductSales.objects.filter(user=user).delete()
+    DailySales.objects.bulk_create(daily.values(), batch_size=1000)
+    DailyProductSales.objects.bulk_create(products.values(), batch_size=1000)
+    logger.info("Rebuilt %d daily and %d daily product rollups for %s", len(daily), len(products), user)
+    return len(daily), len(products)
@@ -1,14 +1,33 @@
+import zoneinfo
+from datetime import timedelta
+
+from django.utils import timezone
 from rest_framework import serializers
 
+from .analytics import LEADERBOARD_METRICS, REVENUE_STATUSES, TRUNC_FUNCTIONS
 from .models import (
     Customer, Category, Product, WooCommerceOrder, OrderItem, 
-    Address, PaymentGateway, ShippingMethod, Coupon, Tax
+    Address, PaymentGateway, ShippingMethod, Coupon, Tax, Job
 )
+from .tenants import scope_to_tenant
+
+class TenantScopedSerializer(serializers.ModelSerializer):
+    # Validates every writable relation against the requesting store's rows only, so another
+    # tenant's pk is rejected exactly like one that does not exist
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is not None:
+            for field in fields.values():
+                if isinstance(field, serializers.RelatedField) and not field.read_only:
+                    field.queryset = scope_to_tenant(field.queryset, request.user)
+        return fields
 
-class CustomerSerializer(serializers.ModelSerializer):
+class CustomerSerializer(TenantScopedSerializer):
     class Meta:
         model = Customer
         fields = '__all__'
+        read_only_fields = ['user']
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -20,12 +39,13 @@ class ProductSerializer(serializers.ModelSerializer):
         model = Product
         fields = '__all__'
 
-class WooCommerceOrderSerializer(serializers.ModelSerializer):
+class WooCommerceOrderSerializer(TenantScopedSerializer):
     class Meta:
         model = WooCommerceOrder
         fields = '__all__'
+        read_only_fields = ['user']
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(TenantScopedSerializer):
     class Meta:
         model = OrderItem
         fields = '__all__'
@@ -40,20 +60,137 @@ class PaymentGatewaySerializer(serializers.ModelSerializer):
     class Meta:
         model = PaymentGateway
         fields = '__all__'
+        read_only_fields = ['user']
 
-class ShippingMethodSerializer(serializers.ModelSerializer):
+class ShippingMethodSerializer(TenantScopedSerializer):
     class Meta:
         model = ShippingMethod
         fields = '__all__'
 
-class CouponSerializer(serializers.ModelSerializer):
+class CouponSerializer(TenantScopedSerializer):
     class Meta:
         model = Coupon
         fields = '__all__'
 
-class TaxSerializer(serializers.ModelSerializer):
+class TaxSerializer(TenantScopedSerializer):
     class Meta:
         model = Tax
         fields = '__all__'
 
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = '__all__'
+        read_only_fields = [
+            'user', 'status', 'attempts', 'max_attempts', 'run_after', 'locked_by', 'locked_at',
+            'last_error', 'output', 'created_at', 'finished_at',
+        ]
+        # Enforced by enqueue(), which returns the pending job instead of failing on a duplicate
+        validators = []
+
+# Expanded, read-only order representation for the order-details endpoint. Every nested field is
+# covered by OrderDetailViewSet's select_related/prefetch_related, so a page costs a fixed number of queries.
+
+class OrderDetailItemSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source='product.name', default=None)
+    category_name = serializers.CharField(source='product.category.name', default=None)
+
+    class Meta:
+        model = OrderItem
+        fields = [
+            'id', 'product', 'wc_product_id', 'wc_variation_id', 'product_name', 'category_name', 'quantity', 'total',
+        ]
+
+class OrderDetailCustomerSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Customer
+        fields = ['id', 'email', 'first_name', 'last_name']
+
+class OrderDetailPaymentGatewaySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PaymentGateway
+        fields = ['id', 'gateway_id', 'name']
+
+class OrderDetailShippingMethodSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ShippingMethod
+        fields = ['method_id', 'method_title', 'total']
+
+class OrderDetailCouponSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Coupon
+        fields = ['code', 'discount']
+
+class OrderDetailTaxSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Tax
+        fields = ['total', 'tax_rate', 'tax_region']
+
+class OrderDetailSerializer(serializers.ModelSerializer):
+    customer = OrderDetailCustomerSerializer(read_only=True)
+    payment_gateway = OrderDetailPaymentGatewaySerializer(read_only=True)
+    billing_address = serializers.JSONField(source='billing_address.address', default=None, read_only=True)
+    shipping_address = serializers.JSONField(source='shipping_address.address', default=None, read_only=True)
+    items = OrderDetailItemSerializer(many=True, read_only=True)
+    shipping_methods = OrderDetailShippingMethodSerializer(source='shippingmethod_set', many=True, read_only=True)
+    coupons = OrderDetailCouponSerializer(source='coupon_set', many=True, read_only=True)
+    taxes = OrderDetailTaxSerializer(source='tax_set', many=True, read_only=True)
+
+    class Meta:
+        model = WooCommerceOrder
+        fields = [
+            'id', 'order_id', 'status', 'total', 'refund_amount', 'date_created', 'date_modified',
+            'customer', 'payment_gateway', 'billing_address', 'shipping_address',
+            'items', 'shipping_methods', 'coupons', 'taxes',
+        ]
+
+class DateRangeQuerySerializer(serializers.Serializer):
+    # [start, end) query parameters of the analytics endpoints; the range defaults to the last 30 days
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+
+    def validate(self, data):
+        data.setdefault('end', timezone.now())
+        data.setdefault('start', data['end'] - timedelta(days=30))
+        if data['start'] >= data['end']:
+            raise serializers.ValidationError('start must be before end')
+        return data
+
+class RevenueQuerySerializer(DateRangeQuerySerializer):
+    interval = serializers.ChoiceField(choices=list(TRUNC_FUNCTIONS), default='day')
+    tz = serializers.CharField(required=False, help_text='IANA time zone the buckets are aligned to')
+    status = serializers.MultipleChoiceField(
+        choices=REVENUE_STATUSES + ['pending', 'failed', 'cancelled'], required=False,
+    )
+
+    def validate_tz(self, value):
+        try:
+            return zoneinfo.ZoneInfo(value)
+        except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+            raise serializers.ValidationError(f'Unknown time zone {value}')
+
+class RevenueBucketSerializer(serializers.Serializer):
+    bucket = serializers.DateTimeField()
+    gross_revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    refunds = serializers.DecimalField(max_digits=14, decimal_places=2)
+    net_revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    orders = serializers.IntegerField()
+    average_order_value = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+class LeaderboardQuerySerializer(DateRangeQuerySerializer):
+    metric = serializers.ChoiceField(choices=list(LEADERBOARD_METRICS), default='revenue')
+
+class ProductSalesSerializer(serializers.Serializer):
+    wc_product_id = serializers.IntegerField()
+    name = serializers.CharField(allow_null=True)
+    category = serializers.CharField(allow_null=True)
+    gross_revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    units_sold = serializers.IntegerField()
+    order_count = serializers.IntegerField()
 
+class CategorySalesSerializer(serializers.Serializer):
+    category_id = serializers.IntegerField()
+    name = serializers.CharField()
+    gross_revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    units_sold = serializers.IntegerField()
+    order_count = serializers.IntegerField()
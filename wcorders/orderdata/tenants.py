@@ -0,0 +1,28 @@
+from django.db.models import Q
+
+from .models import Address, WooCommerceOrder
+
+
+def tenant_orders(user):
+    return WooCommerceOrder.objects.filter(user=user)
+
+
+def scope_to_tenant(queryset, user):
+    # Restricts a queryset of any orderdata model to one store's rows. Used for the API's list
+    # querysets and for the querysets its writable relations are validated against.
+    model = queryset.model
+    if model is Address:
+        # Addresses are shared by content; a tenant sees the ones its orders use
+        orders = tenant_orders(user)
+        return queryset.filter(
+            Q(pk__in=orders.values('billing_address')) | Q(pk__in=orders.values('shipping_address'))
+        )
+
+    fields = {field.name for field in model._meta.concrete_fields}
+    if 'user' in fields:
+        return queryset.filter(user=user)
+    if 'order' in fields:
+        # Order children are found through the tenant's orders; joining on order__user instead
+        # lets the planner walk the whole child table in id order
+        return queryset.filter(order__in=tenant_orders(user))
+    raise ValueError(f'{model.__name__} rows do not belong to a tenant')
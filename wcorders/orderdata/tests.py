@@ -1,3 +1,1063 @@
-from django.test import TestCase
+import base64
+import gzip
+import hashlib
+import hmac
+import io
+import json
+import re
+import threading
+import time
+import unittest
+import uuid
+from unittest import mock
 
-# Create your tests here.
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+import requests
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+from rest_framework.test import APIClient
+
+from authentication.models import SyncCheckpoint, SyncRecord, WooCommerceCredentials
+from . import codec
+from .analytics import LEADERBOARD_METRICS, REVENUE_STATUSES
+from .importer import OrderImporter, sync_catalogue
+from .jobs import claim_for_user, claim_next, enqueue, finish_job, release_stale_jobs, touch_job
+from .management.commands.run_sync_scheduler import Command as SyncSchedulerCommand
+from .models import (
+    Address, Category, Coupon, Customer, DailyProductSales, DailySales, Job, OrderArchive, OrderItem, PaymentGateway,
+    Product, ShippingMethod, Tax, WooCommerceOrder,
+)
+from .purge import purge_user
+from .rollups import aggregate_days
+from .renderers import FastJSONParser, FastJSONRenderer
+from .replay import ReplayServer, ReplayStore, generate_synthetic
+from .webhooks import WebhookBatcher, verify_signature
+from .woocommerce import (
+    TokenBucket, WooCommerceAPIError, WooCommerceClient, WooCommerceConnectionError, WooCommerceResponseError,
+    WooCommerceTimeout,
+)
+
+# Tables holding every tenant's rows; reading any of them with a full scan makes a tenant's request
+# cost grow with the other tenants' data.
+TENANT_TABLES = {
+    'orderdata_woocommerceorder', 'orderdata_orderitem', 'orderdata_customer', 'orderdata_address',
+    'orderdata_shippingmethod', 'orderdata_coupon', 'orderdata_tax', 'orderdata_paymentgateway', 'orderdata_job',
+    'orderdata_product', 'orderdata_category', 'orderdata_dailysales', 'orderdata_dailyproductsales',
+}
+
+ENDPOINTS = [
+    '/data/orders/',
+    '/data/orders/?date_range=1m',
+    '/data/order-details/',
+    '/data/order-items/',
+    '/data/customers/',
+    '/data/addresses/',
+    '/data/payment-gateways/',
+    '/data/shipping-methods/',
+    '/data/coupons/',
+    '/data/taxes/',
+    '/data/products/',
+    '/data/categories/',
+    '/data/jobs/',
+    '/data/analytics/revenue/?interval=week&start=2024-01-01T00:00:00Z&end=2025-01-01T00:00:00Z',
+    '/data/analytics/revenue/?interval=week&start=2024-01-01T00:00:00Z&tz=Europe/London',
+    '/data/analytics/leaderboard/products/?start=2024-01-01T00:00:00Z&end=2025-01-01T00:00:00Z',
+    '/data/analytics/leaderboard/products/?metric=units&start=2024-01-01T12:00:00Z',
+    '/data/analytics/leaderboard/categories/?metric=orders&start=2024-01-01T00:00:00Z',
+]
+
+
+def order_payload(order_id, email, product_id, created='2024-05-01T09:00:00'):
+    address = {'first_name': 'A', 'last_name': 'B', 'city': 'London', 'email': email}
+    return {
+        'id': order_id,
+        'status': 'completed',
+        'total': '30.00',
+        'date_created': created,
+        'date_modified': created,
+        'payment_method': 'stripe',
+        'billing': address,
+        'shipping': {**address, 'email': ''},
+        'line_items': [{'product_id': product_id, 'variation_id': 0, 'quantity': 1, 'total': '25.00'}],
+        'shipping_lines': [{'method_id': 'flat_rate', 'method_title': 'Flat rate', 'total': '5.00'}],
+        'coupon_lines': [{'code': 'SAVE10', 'discount': '2.50'}],
+        'tax_lines': [{'label': 'VAT', 'rate': '20', 'total': '5.00'}],
+        'refunds': [],
+    }
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite specific')
+class TenantQueryPlanTests(TestCase):
+    # Runs every list endpoint as one tenant and asks SQLite how it executed each statement. A
+    # "SCAN" of a tenant table means the query ignores the tenant's indexes.
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create(username=f'store{index}') for index in range(2)]
+        for index, user in enumerate(cls.users):
+            category = Category.objects.create(user=user, category_id=1, name=f'Shoes {index}')
+            Product.objects.create(user=user, product_id=10, name=f'Trainer {index}', price='25.00', category=category)
+            OrderImporter(user).import_page([
+                order_payload(1000 + number, f'customer{number % 5}@store{index}.com', 10) for number in range(20)
+            ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def query_plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def table_scans(self, plan):
+        # "SCAN t" is a full table scan; "SCAN t USING INDEX"/"COVERING INDEX" walks an index instead
+        scans = set()
+        for step in plan:
+            match = re.match(r'SCAN (\w+)(?: AS \w+)?$', step)
+            if match:
+                scans.add(match.group(1))
+        return scans
+
+    def test_endpoints_use_indexes(self):
+        for url in ENDPOINTS:
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                for query in queries.captured_queries:
+                    plan = self.query_plan(query['sql'])
+                    self.assertFalse(
+                        self.table_scans(plan) & TENANT_TABLES,
+                        f"{url} scans a tenant table:\n{query['sql']}\n" + '\n'.join(plan),
+                    )
+
+    def test_endpoints_only_return_own_rows(self):
+        other_orders = set(WooCommerceOrder.objects.filter(user=self.users[1]).values_list('pk', flat=True))
+        response = self.client.get('/data/orders/?page_size=500')
+        returned = {order['id'] for order in response.json()['results']}
+        self.assertEqual(len(returned), 20)
+        self.assertFalse(returned & other_orders)
+
+        response = self.client.get('/data/customers/')
+        self.assertTrue(all(customer['email'].endswith('@store0.com') for customer in response.json()['results']))
+
+        # Both stores have a product 10; each store's line items link to and are labelled with its own
+        response = self.client.get('/data/products/')
+        self.assertEqual([product['name'] for product in response.json()['results']], ['Trainer 0'])
+        response = self.client.get('/data/order-details/?page_size=1')
+        self.assertEqual(response.json()['results'][0]['items'][0]['product_name'], 'Trainer 0')
+        response = self.client.get('/data/analytics/leaderboard/products/?start=2024-05-01T06:00:00Z')
+        self.assertEqual(response.json()['results'][0]['name'], 'Trainer 0')
+
+    def test_relations_only_accept_own_rows(self):
+        own, other = (WooCommerceOrder.objects.filter(user=user).first() for user in self.users)
+
+        item = {'order': other.pk, 'wc_product_id': 10, 'quantity': 1, 'total': '1.00'}
+        response = self.client.post('/data/order-items/', item, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('order', response.json())
+        self.assertEqual(self.client.post('/data/order-items/', {**item, 'order': own.pk}, format='json').status_code, 201)
+
+        for field in ('customer', 'billing_address', 'payment_gateway'):
+            with self.subTest(field=field):
+                response = self.client.patch(f'/data/orders/{own.pk}/', {field: getattr(other, f'{field}_id')}, format='json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(field, response.json())
+        self.assertNotEqual(WooCommerceOrder.objects.get(pk=own.pk).customer.user, self.users[1])
+
+        response = self.client.patch(f'/data/orders/{own.pk}/', {'customer': own.customer_id}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_catalogue_and_addresses_are_read_only(self):
+        order = WooCommerceOrder.objects.filter(user=self.users[0]).first()
+        product = Product.objects.get(user=self.users[0])
+        for url in (
+            f'/data/products/{product.pk}/',
+            f'/data/categories/{product.category_id}/',
+            f'/data/addresses/{order.shipping_address_id}/',
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.patch(url, {'name': 'Changed'}, format='json').status_code, 405)
+                self.assertEqual(self.client.delete(url).status_code, 405)
+        self.assertEqual(self.client.post('/data/products/', {}, format='json').status_code, 405)
+        self.assertEqual(Product.objects.get(pk=product.pk).name, 'Trainer 0')
+
+    def test_requires_authentication(self):
+        self.assertEqual(APIClient().get('/data/orders/').status_code, 401)
+
+    def test_revenue_rollups_match_raw_orders(self):
+        # Whole-day ranges read DailySales; asking for explicit statuses forces the raw order query
+        url = '/data/analytics/revenue/?interval=day&start=2024-04-01T00:00:00Z&end=2024-06-01T00:00:00Z'
+        statuses = ''.join(f'&status={status}' for status in REVENUE_STATUSES)
+        self.assertEqual(self.client.get(url).json(), self.client.get(url + statuses).json())
+
+
+class RollupRefreshTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='store')
+        OrderImporter(cls.user).import_page([
+            order_payload(1000, 'a@store.com', 10, created='2024-05-01T09:00:00'),
+            order_payload(1001, 'a@store.com', 11, created='2024-05-01T15:00:00'),
+            order_payload(1002, 'b@store.com', 10, created='2024-05-02T09:00:00'),
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.orders = {order.order_id: order for order in WooCommerceOrder.objects.filter(user=self.user)}
+
+    def assert_rollups_match_orders(self):
+        daily, products = aggregate_days(self.user)
+        fields = ['date', 'orders', 'items', 'revenue', 'refunds', 'tax', 'shipping', 'discounts']
+        self.assertEqual(
+            sorted(DailySales.objects.filter(user=self.user).values_list(*fields)),
+            sorted(tuple(getattr(row, field) for field in fields) for row in daily.values()),
+        )
+        fields = ['date', 'wc_product_id', 'orders', 'quantity', 'revenue']
+        self.assertEqual(
+            sorted(DailyProductSales.objects.filter(user=self.user).values_list(*fields)),
+            sorted(tuple(getattr(row, field) for field in fields) for row in products.values()),
+        )
+        for customer in Customer.objects.filter(user=self.user):
+            orders = WooCommerceOrder.objects.filter(customer=customer)
+            self.assertEqual(
+                (customer.total_spent, customer.orders_count),
+                (sum(order.total for order in orders), orders.count()),
+            )
+
+    def test_api_writes_keep_rollups_current(self):
+        first, second, third = (self.orders[order_id] for order_id in (1000, 1001, 1002))
+        steps = [
+            ('patch', f'/data/orders/{first.pk}/', {'total': '99.00'}),
+            ('patch', f'/data/orders/{first.pk}/', {'date_created': '2024-05-03T09:00:00Z'}),
+            ('patch', f'/data/orders/{second.pk}/', {'customer': third.customer_id}),
+            ('post', '/data/order-items/', {'order': second.pk, 'wc_product_id': 12, 'quantity': 4, 'total': '8.00'}),
+            ('patch', f'/data/coupons/{second.coupon_set.get().pk}/', {'discount': '7.00'}),
+            ('post', '/data/shipping-methods/', {'order': third.pk, 'method_id': 'express', 'method_title': 'Express', 'total': '9.00'}),
+            ('delete', f'/data/taxes/{third.tax_set.get().pk}/', None),
+            ('delete', f'/data/orders/{third.pk}/', None),
+        ]
+        for method, url, data in steps:
+            with self.subTest(method=method, url=url):
+                response = getattr(self.client, method)(url, data, format='json')
+                self.assertLess(response.status_code, 300, response.content)
+                self.assert_rollups_match_orders()
+        self.assertFalse(DailySales.objects.filter(user=self.user, date=date(2024, 5, 2)).exists())
+
+
+class LeaderboardPaginationTests(TestCase):
+    # Twelve products in four categories, bought in every order: units and revenue tie in groups of
+    # four products, order counts tie across all of them and every category totals the same
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='store')
+        categories = [Category.objects.create(user=cls.user, category_id=number, name=f'C{number}') for number in range(1, 5)]
+        for product_id in range(1, 13):
+            Product.objects.create(
+                user=cls.user, product_id=product_id, name=f'P{product_id}', price='5.00',
+                category=categories[product_id % 4],
+            )
+        line_items = [
+            {'product_id': product_id, 'variation_id': 0, 'quantity': product_id % 3 + 1, 'total': f'{(product_id % 3 + 1) * 5}.00'}
+            for product_id in range(1, 13)
+        ]
+        OrderImporter(cls.user).import_page([
+            {**order_payload(1000 + number, f'c{number}@store.com', 1), 'line_items': line_items} for number in range(6)
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def read_all(self, url):
+        rows = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            rows += response.json()['results']
+            url = response.json()['next']
+        return rows
+
+    def test_pages_through_ties_without_duplicates_or_gaps(self):
+        ranges = {
+            'rollup': 'start=2024-05-01T00:00:00Z&end=2024-05-02T00:00:00Z',
+            'raw': 'start=2024-05-01T06:00:00Z&end=2024-05-02T00:00:00Z',
+        }
+        for group, key, expected, page_size in (('products', 'wc_product_id', 12, 5), ('categories', 'category_id', 4, 3)):
+            for path, dates in ranges.items():
+                for metric, field in LEADERBOARD_METRICS.items():
+                    with self.subTest(group=group, path=path, metric=metric):
+                        url = f'/data/analytics/leaderboard/{group}/?metric={metric}&page_size={page_size}&{dates}'
+                        with CaptureQueriesContext(connection) as queries:
+                            rows = self.read_all(url)
+                        keys = [row[key] for row in rows]
+                        self.assertEqual(sorted(keys), list(range(1, expected + 1)))
+                        ranking = [(-Decimal(str(row[field])), row[key]) for row in rows]
+                        self.assertEqual(ranking, sorted(ranking))
+                        rollup = any('orderdata_dailyproductsales' in query['sql'] for query in queries.captured_queries)
+                        self.assertEqual(rollup, group == 'products' and path == 'rollup')
+
+    def test_malformed_cursor_is_not_found(self):
+        url = '/data/analytics/leaderboard/products/?start=2024-05-01T06:00:00Z&cursor='
+        for cursor in ('not-a-cursor', base64.b64encode(b'p=abc').decode(), base64.b64encode(b'p=1.5').decode()):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(url + cursor).status_code, 404)
+
+
+class CodecTests(TestCase):
+    document = {
+        'when': datetime(2024, 5, 1, 9, 30, tzinfo=dt_timezone.utc), 'day': date(2024, 5, 1),
+        'total': Decimal('12.50'), 'id': uuid.UUID(int=1), 7: 'naïve',
+    }
+    expected = (
+        '{"when":"2024-05-01T09:30:00Z","day":"2024-05-01","total":12.5,'
+        '"id":"00000000-0000-0000-0000-000000000001","7":"naïve"}'
+    ).encode()
+
+    def test_both_codecs_render_the_same_documents(self):
+        self.assertEqual(FastJSONRenderer().render(self.document), self.expected)
+        with mock.patch.object(codec, 'orjson', None):
+            self.assertEqual(FastJSONRenderer().render(self.document), self.expected)
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    def test_indented_output_is_left_to_drf(self):
+        rendered = FastJSONRenderer().render({'a': [1]}, 'application/json; indent=2')
+        self.assertEqual(rendered, b'{\n  "a": [\n    1\n  ]\n}')
+
+    def test_parser(self):
+        for orjson in (codec.orjson, None):
+            with self.subTest(orjson=orjson), mock.patch.object(codec, 'orjson', orjson):
+                self.assertEqual(FastJSONParser().parse(io.BytesIO('{"a": ["é", 1.5]}'.encode())), {'a': ['é', 1.5]})
+                with self.assertRaises(ParseError):
+                    FastJSONParser().parse(io.BytesIO(b'{"a": '))
+
+    def test_responses_are_gzipped_when_accepted(self):
+        user = User.objects.create(username='store')
+        OrderImporter(user).import_page([
+            order_payload(1000 + day, 'a@store.com', 10, created=f'2024-05-{day:02d}T09:00:00') for day in range(1, 11)
+        ])
+        client = APIClient()
+        client.force_authenticate(user)
+        url = '/data/analytics/revenue/?interval=day&start=2024-05-01T00:00:00Z&end=2024-06-01T00:00:00Z'
+
+        plain = client.get(url)
+        self.assertNotIn('Content-Encoding', plain)
+        body = json.loads(plain.content)
+        # Request parameters and buckets use the same datetime format
+        self.assertEqual(body['start'], '2024-05-01T00:00:00Z')
+        self.assertEqual(body['results'][0]['bucket'], '2024-05-01T00:00:00Z')
+
+        compressed = client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+
+
+@override_settings(JOB_RETRY_DELAY=60, JOB_LOCK_TIMEOUT=3600)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='store')
+
+    def test_claims_oldest_job_and_one_per_user(self):
+        other = User.objects.create(username='other')
+        first, _ = enqueue(self.user, Job.KIND_SYNC)
+        second, _ = enqueue(self.user, Job.KIND_PURGE)
+        third, _ = enqueue(other, Job.KIND_SYNC)
+        Job.objects.filter(pk=third.pk).update(run_after=timezone.now() + timedelta(hours=1))
+
+        job = claim_next('worker-1')
+        self.assertEqual((job.pk, job.status, job.locked_by, job.attempts), (first.pk, Job.STATUS_RUNNING, 'worker-1', 1))
+        # The store's purge waits for its sync and the other store's job is not due yet
+        self.assertIsNone(claim_next('worker-2'))
+
+        finish_job(job, 'done')
+        self.assertEqual(claim_next('worker-2').pk, second.pk)
+
+    def test_failed_jobs_back_off_then_fail(self):
+        enqueue(self.user, Job.KIND_SYNC)
+        for attempt, delay in ((1, 60), (2, 120)):
+            job = claim_next('worker')
+            self.assertEqual(job.attempts, attempt)
+            before = timezone.now()
+            finish_job(job, 'output', error=RuntimeError('store offline'))
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.last_error, job.locked_by), (Job.STATUS_PENDING, 'store offline', ''))
+            self.assertGreaterEqual(job.run_after, before + timedelta(seconds=delay))
+            self.assertIsNone(claim_next('worker'))
+            Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+
+        job = claim_next('worker')
+        finish_job(job, 'output', error=RuntimeError('store offline'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_FAILED, 3))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_stale_running_jobs_are_released(self):
+        stale = claim_for_user(self.user.pk, Job.KIND_SYNC, 'dead-worker')
+        other = User.objects.create(username='other')
+        fresh = claim_for_user(other.pk, Job.KIND_SYNC, 'live-worker')
+        Job.objects.filter(pk=stale.pk).update(locked_at=timezone.now() - timedelta(hours=2))
+
+        self.assertEqual(release_stale_jobs(), 1)
+        stale.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertEqual((stale.status, stale.locked_by, stale.locked_at), (Job.STATUS_PENDING, '', None))
+        self.assertEqual(fresh.status, Job.STATUS_RUNNING)
+        # The store is no longer blocked by the dead worker's job
+        self.assertEqual(claim_next('worker').pk, stale.pk)
+
+    def test_stale_job_gives_way_to_a_pending_trigger(self):
+        stale = claim_for_user(self.user.pk, Job.KIND_SYNC, 'dead-worker')
+        Job.objects.filter(pk=stale.pk).update(locked_at=timezone.now() - timedelta(hours=2))
+        pending, created = enqueue(self.user, Job.KIND_SYNC)
+        self.assertTrue(created)
+
+        self.assertEqual(release_stale_jobs(), 1)
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.locked_at), (Job.STATUS_FAILED, None))
+        self.assertIn('superseded', stale.last_error)
+        self.assertEqual(claim_next('worker').pk, pending.pk)
+
+    def test_heartbeat_keeps_long_jobs_locked(self):
+        enqueue(self.user, Job.KIND_IMPORT)
+        job = claim_next('worker-1')
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=2))
+
+        self.assertTrue(touch_job(job))
+        self.assertEqual(release_stale_jobs(), 0)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), (Job.STATUS_RUNNING, 'worker-1'))
+
+        # A worker whose job was released and claimed elsewhere stops renewing it
+        Job.objects.filter(pk=job.pk).update(locked_by='worker-2')
+        self.assertFalse(touch_job(job))
+
+    def test_scheduled_sync_shares_the_running_job_slot(self):
+        scheduled = claim_for_user(self.user.pk, Job.KIND_SYNC, 'scheduler')
+        self.assertEqual(scheduled.status, Job.STATUS_RUNNING)
+        self.assertIsNone(claim_for_user(self.user.pk, Job.KIND_SYNC, 'scheduler'))
+
+        # A queued purge waits for the scheduled sync instead of running beside it
+        enqueue(self.user, Job.KIND_PURGE)
+        self.assertIsNone(claim_next('worker'))
+
+    def test_scheduler_postpones_a_store_with_a_running_job(self):
+        enqueue(self.user, Job.KIND_IMPORT)
+        claim_next('worker')
+        command = SyncSchedulerCommand()
+        module = 'orderdata.management.commands.run_sync_scheduler'
+        with mock.patch(f'{module}.connections'), mock.patch(f'{module}.close_old_connections'), \
+                mock.patch(f'{module}.run_job') as run_job:
+            job, _, error = command.sync_store(self.user.pk)
+        self.assertIsNone(job)
+        self.assertIsNone(error)
+        run_job.assert_not_called()
+        self.assertEqual(Job.objects.filter(user=self.user).count(), 1)
+        self.assertGreater(SyncRecord.objects.get(user=self.user).next_sync_time, timezone.now())
+
+
+    @override_settings(SYNC_MIN_INTERVAL=60, SYNC_MAX_INTERVAL=3600)
+    def test_scheduler_backs_off_a_store_whose_sync_errors(self):
+        SyncRecord.objects.create(user=self.user, last_sync_time=timezone.now(), poll_interval=300)
+        command = SyncSchedulerCommand()
+        module = 'orderdata.management.commands.run_sync_scheduler'
+        with mock.patch(f'{module}.connections'), mock.patch(f'{module}.close_old_connections'), \
+                mock.patch(f'{module}.claim_for_user', side_effect=OperationalError('database is locked')):
+            job, _, error = command.sync_store(self.user.pk)
+        self.assertIsNone(job)
+        self.assertIsInstance(error, OperationalError)
+        sync_record = SyncRecord.objects.get(user=self.user)
+        self.assertEqual(sync_record.poll_interval, 600)
+        self.assertGreater(sync_record.next_sync_time, timezone.now() + timedelta(seconds=590))
+
+    def test_scheduler_releases_its_own_stale_jobs(self):
+        stale = claim_for_user(self.user.pk, Job.KIND_SYNC, 'killed-scheduler')
+        Job.objects.filter(pk=stale.pk).update(locked_at=timezone.now() - timedelta(hours=2))
+        command = SyncSchedulerCommand(stdout=io.StringIO())
+        command.release_stale_jobs()
+        self.assertIsNotNone(claim_for_user(self.user.pk, Job.KIND_SYNC, 'scheduler'))
+
+    @override_settings(SYNC_MIN_INTERVAL=60, SYNC_MAX_INTERVAL=3600, SYNC_TARGET_ORDERS_PER_POLL=100)
+    def test_poll_interval_follows_order_volume(self):
+        next_poll_interval = SyncSchedulerCommand().next_poll_interval
+        # Twice the target per poll halves the interval, half of it doubles it
+        self.assertEqual(next_poll_interval(600, 200, failed=False), 300)
+        self.assertEqual(next_poll_interval(600, 50, failed=False), 1200)
+        # Quiet and failing stores back off exponentially
+        self.assertEqual(next_poll_interval(600, 0, failed=False), 1200)
+        self.assertEqual(next_poll_interval(600, 500, failed=True), 1200)
+        # Clamped to the floor and the ceiling
+        self.assertEqual(next_poll_interval(600, 10000, failed=False), 60)
+        self.assertEqual(next_poll_interval(3000, 0, failed=False), 3600)
+
+class WebhookTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='store')
+        WooCommerceCredentials.objects.create(
+            user=self.user, store_url='https://shop.example.com', consumer_key='ck', consumer_secret='cs',
+            webhook_secret='secret',
+        )
+        self.url = f'/data/webhooks/{self.user.pk}/'
+
+    def signed(self, secret, body):
+        return base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+
+    def deliver(self, body, topic='order.updated', signature=None):
+        return APIClient().post(
+            self.url, body, content_type='application/json',
+            HTTP_X_WC_WEBHOOK_TOPIC=topic,
+            HTTP_X_WC_WEBHOOK_SIGNATURE=self.signed('secret', body) if signature is None else signature,
+        )
+
+    def test_verify_signature(self):
+        body = b'{"id": 1}'
+        self.assertTrue(verify_signature('secret', body, self.signed('secret', body)))
+        self.assertFalse(verify_signature('secret', body, self.signed('other', body)))
+        self.assertFalse(verify_signature('secret', body + b' ', self.signed('secret', body)))
+        self.assertFalse(verify_signature('secret', body, None))
+
+    def test_view_responses(self):
+        body = json.dumps(order_payload(1000, 'a@store.com', 10)).encode()
+        with mock.patch('orderdata.views.batcher') as batcher:
+            self.assertEqual(self.deliver(body).status_code, 202)
+            batcher.enqueue.assert_called_once_with(self.user.pk, 'order.updated', json.loads(body))
+
+            self.assertEqual(self.deliver(body, signature='forged').status_code, 401)
+            self.assertEqual(self.deliver(body, topic='product.updated').status_code, 400)
+            self.assertEqual(self.deliver(b'{"no_id": true}').status_code, 400)
+            self.assertEqual(self.deliver(b'not json').status_code, 400)
+            ping = APIClient().post(self.url, 'webhook_id=1', content_type='application/x-www-form-urlencoded')
+            self.assertEqual(ping.status_code, 200)
+            self.assertEqual(batcher.enqueue.call_count, 1)
+        self.assertEqual(APIClient().post('/data/webhooks/999/', body, content_type='application/json').status_code, 404)
+
+    def test_older_deliveries_never_overwrite_newer_data(self):
+        older = {**order_payload(1000, 'a@store.com', 10), 'status': 'processing'}
+        newer = {**order_payload(1000, 'a@store.com', 10), 'status': 'refunded', 'date_modified': '2024-05-02T09:00:00'}
+        batcher = WebhookBatcher(batch_size=10, flush_interval=1, max_size=10)
+
+        # Out of order within one batch
+        batcher.flush([(self.user.pk, 'order.updated', newer), (self.user.pk, 'order.updated', older)])
+        self.assertEqual(WooCommerceOrder.objects.get(user=self.user, order_id=1000).status, 'refunded')
+
+        # A redelivery of the older version in a later batch
+        batcher.flush([(self.user.pk, 'order.updated', older)])
+        self.assertEqual(WooCommerceOrder.objects.get(user=self.user, order_id=1000).status, 'refunded')
+
+        # A newer version still applies
+        newest = {**newer, 'status': 'completed', 'date_modified': '2024-05-03T09:00:00'}
+        batcher.flush([(self.user.pk, 'order.updated', newest)])
+        self.assertEqual(WooCommerceOrder.objects.get(user=self.user, order_id=1000).status, 'completed')
+
+    def test_one_bad_delivery_only_loses_its_own_store(self):
+        other = User.objects.create(username='other')
+        broken = order_payload(1000, 'a@store.com', 10)
+        del broken['line_items']
+        batcher = WebhookBatcher(batch_size=10, flush_interval=1, max_size=10)
+
+        with self.assertLogs('orderdata.webhooks', 'ERROR') as logs:
+            batcher.flush([
+                (self.user.pk, 'order.created', broken),
+                (other.pk + 1, 'order.created', order_payload(1001, 'b@store.com', 10)),
+                (other.pk, 'order.created', order_payload(1002, 'c@store.com', 10)),
+            ])
+        self.assertEqual(len(logs.records), 2)
+        self.assertFalse(WooCommerceOrder.objects.filter(user=self.user).exists())
+        self.assertEqual(list(WooCommerceOrder.objects.values_list('user', 'order_id')), [(other.pk, 1002)])
+
+    def test_deleted_orders_leave_the_archive(self):
+        batcher = WebhookBatcher(batch_size=10, flush_interval=1, max_size=10)
+        batcher.flush([(self.user.pk, 'order.created', order_payload(order_id, 'a@store.com', 10)) for order_id in (1, 2)])
+        batcher.flush([(self.user.pk, 'order.updated', {**order_payload(1, 'a@store.com', 10), 'date_modified': '2024-05-02T09:00:00'})])
+        self.assertEqual(OrderArchive.objects.filter(user=self.user, order_id=1).count(), 2)
+
+        batcher.flush([(self.user.pk, 'order.deleted', {'id': 1})])
+        self.assertFalse(OrderArchive.objects.filter(user=self.user, order_id=1).exists())
+
+        call_command('rebuild_from_archive', user=self.user.pk, stdout=io.StringIO())
+        self.assertEqual(list(WooCommerceOrder.objects.filter(user=self.user).values_list('order_id', flat=True)), [2])
+
+
+def api_response(status_code, body=b'[]', headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = body
+    response.headers.update(headers or {})
+    return response
+
+
+@override_settings(
+    WOOCOMMERCE_REQUESTS_PER_SECOND=10000, WOOCOMMERCE_REQUEST_BURST=10000, WOOCOMMERCE_MAX_RETRIES=3,
+    WOOCOMMERCE_BACKOFF=0.5,
+)
+class WooCommerceClientTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='store')
+        self.store = generate_synthetic(ReplayStore(), orders=0, products=250, categories=3)
+
+    def client_for(self, url, max_concurrency=4):
+        credentials = WooCommerceCredentials.objects.create(
+            user=self.user, store_url=url, consumer_key='ck', consumer_secret='cs', max_concurrency=max_concurrency,
+        )
+        client = WooCommerceClient(credentials)
+        self.addCleanup(client.close)
+        return client
+
+    def serve(self, **options):
+        server = ReplayServer(self.store, **options)
+        server.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def respond(self, client, *responses):
+        # Answers the client's requests with `responses` in turn and records the retry delays
+        session = mock.patch.object(client.session, 'get', side_effect=list(responses))
+        sleep = mock.patch('orderdata.woocommerce.time.sleep')
+        self.addCleanup(session.stop)
+        self.addCleanup(sleep.stop)
+        return session.start(), sleep.start()
+
+    def test_retries_injected_server_errors(self):
+        server = self.serve(error_rate=0.5, seed=3)
+        client = self.client_for(server.url)
+        with mock.patch('orderdata.woocommerce.time.sleep') as sleep, self.assertLogs('orderdata.woocommerce', 'WARNING'):
+            pages = [client.get('products', {'per_page': 100, 'page': page}) for page in (1, 2, 3)]
+        self.assertEqual([len(items) for items in pages], [100, 100, 50])
+        self.assertEqual(server.request_count, 3 + sleep.call_count)
+        self.assertTrue(sleep.called)
+
+    def test_retry_after_and_exponential_backoff(self):
+        client = self.client_for('https://shop.example.com')
+        get, sleep = self.respond(
+            client, api_response(429, headers={'Retry-After': '7'}), api_response(503), requests.Timeout(),
+            api_response(200, b'[{"id": 1}]'),
+        )
+        with self.assertLogs('orderdata.woocommerce', 'WARNING') as logs:
+            self.assertEqual(client.get('orders'), [{'id': 1}])
+        self.assertEqual(len(logs.records), 3)
+        self.assertEqual(get.call_count, 4)
+        # Retry-After wins over the backoff, which doubles on every further attempt
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [7.0, 1.0, 2.0])
+
+    def test_client_errors_are_not_retried(self):
+        client = self.client_for('https://shop.example.com')
+        get, sleep = self.respond(client, api_response(401, b'{"code": "woocommerce_rest_cannot_view"}'))
+        with self.assertRaises(WooCommerceAPIError) as raised:
+            client.get('orders')
+        self.assertEqual(raised.exception.status_code, 401)
+        self.assertEqual((get.call_count, sleep.call_count), (1, 0))
+
+    def test_typed_errors_once_retries_run_out(self):
+        client = self.client_for('https://shop.example.com')
+        for failure, error_class in (
+            (api_response(502), WooCommerceAPIError),
+            (requests.Timeout(), WooCommerceTimeout),
+            (requests.ConnectionError(), WooCommerceConnectionError),
+        ):
+            with self.subTest(error=error_class.__name__):
+                get, sleep = self.respond(client, *[failure] * 4)
+                with self.assertRaises(error_class), self.assertLogs('orderdata.woocommerce', 'WARNING'):
+                    client.get('orders')
+                self.assertEqual((get.call_count, sleep.call_count), (4, 3))
+
+        self.respond(client, api_response(200, b'<html>Bad gateway</html>'))
+        with self.assertRaises(WooCommerceResponseError):
+            client.get('orders')
+
+    def test_pages_after_the_first_are_fetched_in_parallel(self):
+        server = self.serve(latency_ms=300)
+        client = self.client_for(server.url, max_concurrency=9)
+        started = time.monotonic()
+        pages = list(client.iter_pages('products', {'per_page': 25}))
+        elapsed = time.monotonic() - started
+
+        self.assertEqual([page for page, _ in pages], list(range(1, 11)))
+        self.assertEqual(sorted(item['id'] for _, items in pages for item in items), list(range(1, 251)))
+        # X-WP-TotalPages bounds the requests, and pages 2-10 together take about as long as one
+        self.assertEqual(server.request_count, 10)
+        self.assertLess(elapsed, 4 * 0.3)
+
+    def test_page_requests_in_flight_stay_within_the_concurrency(self):
+        server = self.serve()
+        client = self.client_for(server.url)
+        query = self.store.query
+        lock = threading.Lock()
+        in_flight = []
+        peak = []
+
+        def slow_query(endpoint, params):
+            with lock:
+                in_flight.append(params['page'])
+                peak.append(len(in_flight))
+            time.sleep(0.1)
+            with lock:
+                in_flight.remove(params['page'])
+            return query(endpoint, params)
+
+        with mock.patch.object(self.store, 'query', slow_query):
+            pages = list(client.iter_pages('products', {'per_page': 25}, concurrency=3))
+        self.assertEqual(len(pages), 10)
+        self.assertEqual(max(peak), 3)
+
+    def test_token_bucket_throttles_after_the_burst(self):
+        bucket = TokenBucket(rate=20, capacity=2)
+        started = time.monotonic()
+        for _ in range(2):
+            bucket.acquire()
+        self.assertLess(time.monotonic() - started, 0.04)
+        for _ in range(4):
+            bucket.acquire()
+        # Four more tokens at 20 per second
+        self.assertGreaterEqual(time.monotonic() - started, 0.19)
+
+
+@override_settings(WOOCOMMERCE_REQUESTS_PER_SECOND=10000, WOOCOMMERCE_REQUEST_BURST=10000)
+class SyncOrdersTests(TestCase):
+    def setUp(self):
+        self.store = generate_synthetic(ReplayStore(), orders=250, products=20, categories=3)
+        self.server = ReplayServer(self.store)
+        self.server.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.user = User.objects.create(username='store')
+        WooCommerceCredentials.objects.create(
+            user=self.user, store_url=self.server.url, consumer_key='ck', consumer_secret='cs',
+        )
+
+    def test_orders_modified_mid_run_do_not_hide_others(self):
+        # After the first page is served, its first order is modified, which takes it out of the
+        # run's window and shifts every later order back by one
+        query = self.store.query
+        served = []
+
+        def query_and_modify(endpoint, params):
+            rows, total, total_pages = query(endpoint, params)
+            if endpoint == 'orders':
+                served.append(rows)
+                if len(served) == 1:
+                    now = timezone.now().astimezone(dt_timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+                    self.store.add('orders', {
+                        **rows[0], 'status': 'refunded', 'date_modified': now, 'date_modified_gmt': now,
+                    })
+            return rows, total, total_pages
+
+        with mock.patch.object(self.store, 'query', query_and_modify):
+            call_command('sync_orders', user=self.user.pk, stdout=io.StringIO())
+
+        self.assertEqual(WooCommerceOrder.objects.filter(user=self.user).count(), 250)
+        # The modification itself belongs to the window of a run starting after it
+        time.sleep(1)
+        call_command('sync_orders', user=self.user.pk, stdout=io.StringIO())
+        modified = WooCommerceOrder.objects.get(user=self.user, order_id=served[0][0]['id'])
+        self.assertEqual(modified.status, 'refunded')
+
+    def test_first_sync_after_the_import_only_fetches_new_changes(self):
+        before = timezone.now()
+        call_command('first_import_wc_order_data', user=self.user.pk, stdout=io.StringIO())
+        self.assertEqual(WooCommerceOrder.objects.filter(user=self.user).count(), 250)
+        self.assertGreaterEqual(SyncRecord.objects.get(user=self.user).last_sync_time, before)
+
+        call_command('sync_orders', user=self.user.pk, stdout=io.StringIO())
+        self.assertEqual(SyncCheckpoint.objects.get(user=self.user).orders_done, 0)
+
+    def test_order_pages_are_fetched_in_parallel(self):
+        query = self.store.query
+        lock = threading.Lock()
+        in_flight = []
+        peak = []
+
+        def slow_query(endpoint, params):
+            if endpoint != 'orders':
+                return query(endpoint, params)
+            with lock:
+                in_flight.append(params['page'])
+                peak.append(len(in_flight))
+            time.sleep(0.2)
+            with lock:
+                in_flight.remove(params['page'])
+            return query(endpoint, params)
+
+        with mock.patch.object(self.store, 'query', slow_query):
+            call_command('sync_orders', user=self.user.pk, concurrency=4, stdout=io.StringIO())
+
+        self.assertEqual(WooCommerceOrder.objects.filter(user=self.user).count(), 250)
+        # Page 1 tells how many pages there are; pages 2 and 3 are then requested together
+        self.assertEqual(len(peak), 3)
+        self.assertEqual(max(peak), 2)
+
+
+@override_settings(WOOCOMMERCE_REQUESTS_PER_SECOND=10000, WOOCOMMERCE_REQUEST_BURST=10000)
+class CatalogueSyncTests(TestCase):
+    def setUp(self):
+        self.store = generate_synthetic(ReplayStore(), orders=0, products=150, categories=3)
+        self.server = ReplayServer(self.store)
+        self.server.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.user = User.objects.create(username='store')
+        self.credentials = WooCommerceCredentials.objects.create(
+            user=self.user, store_url=self.server.url, consumer_key='ck', consumer_secret='cs',
+        )
+
+    def test_products_changed_on_pages_already_read_are_synced_next_time(self):
+        # While the second page is in flight, a product on the first page changes and then one on
+        # the second page changes again, later
+        query = self.store.query
+        products = self.store.items['products']
+
+        def query_and_modify(endpoint, params):
+            if endpoint == 'products' and params.get('page') == '2' and products[1]['name'] == 'Product 1':
+                self.store.add('products', {**products[1], 'name': 'Renamed', 'date_modified_gmt': '2029-01-01T00:00:00'})
+                self.store.add('products', {**products[150], 'date_modified_gmt': '2030-01-01T00:00:00'})
+            return query(endpoint, params)
+
+        with WooCommerceClient(self.credentials) as client, mock.patch.object(self.store, 'query', query_and_modify):
+            self.assertEqual(sync_catalogue(client, self.user), 150)
+            self.assertEqual(Product.objects.get(user=self.user, product_id=1).name, 'Product 1')
+            self.assertLess(SyncRecord.objects.get(user=self.user).catalogue_sync_time, timezone.now())
+
+            self.assertEqual(sync_catalogue(client, self.user), 2)
+        self.assertEqual(Product.objects.get(user=self.user, product_id=1).name, 'Renamed')
+
+
+class OrderImporterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='store')
+
+    def writes(self, queries):
+        return [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+        ]
+
+    def test_unchanged_page_writes_nothing(self):
+        page = [order_payload(order_id, f'customer{order_id}@store.com', 10) for order_id in range(1, 6)]
+        OrderImporter(self.user).import_page(page)
+
+        with CaptureQueriesContext(connection) as queries:
+            written = OrderImporter(self.user).import_page(page)
+        self.assertEqual(written, [])
+        self.assertEqual(self.writes(queries), [])
+
+    def test_changed_order_only_rewrites_changed_children(self):
+        line = {'product_id': 10, 'variation_id': 0, 'quantity': 1, 'total': '25.00'}
+        payload = order_payload(1, 'a@store.com', 10)
+        payload['line_items'] = [line, dict(line), {**line, 'product_id': 11, 'quantity': 2, 'total': '10.00'}]
+        OrderImporter(self.user).import_page([payload])
+        order = WooCommerceOrder.objects.get(user=self.user, order_id=1)
+        items = {pk: product_id for pk, product_id in order.items.values_list('pk', 'wc_product_id')}
+        others = {model: set(model.objects.values_list('pk', flat=True)) for model in (ShippingMethod, Coupon, Tax)}
+
+        # One of the two identical lines goes, product 11 changes quantity and product 12 is added
+        payload = {**payload, 'date_modified': '2024-05-02T09:00:00', 'line_items': [
+            line, {**line, 'product_id': 11, 'quantity': 3, 'total': '15.00'}, {**line, 'product_id': 12, 'total': '5.00'},
+        ]}
+        with CaptureQueriesContext(connection) as queries:
+            OrderImporter(self.user).import_page([payload])
+
+        after = {pk: product_id for pk, product_id in order.items.values_list('pk', 'wc_product_id')}
+        kept = after.keys() & items.keys()
+        self.assertEqual([items[pk] for pk in kept], [10])
+        self.assertEqual(sorted(after[pk] for pk in after.keys() - kept), [11, 12])
+        self.assertEqual(sorted(order.items.values_list('wc_product_id', 'quantity')), [(10, 1), (11, 3), (12, 1)])
+        for model, pks in others.items():
+            self.assertEqual(set(model.objects.values_list('pk', flat=True)), pks)
+
+        # Apart from the order row, the item table is the only child table written to
+        child_writes = [sql for sql in self.writes(queries) if any(
+            table in sql for table in ('orderdata_orderitem', 'orderdata_shippingmethod', 'orderdata_coupon', 'orderdata_tax')
+        ) and not sql.startswith('UPDATE "orderdata_orderitem"')]
+        self.assertEqual(len(child_writes), 2)
+        self.assertTrue(child_writes[0].startswith('DELETE FROM "orderdata_orderitem"'))
+        self.assertTrue(child_writes[1].startswith('INSERT INTO "orderdata_orderitem"'))
+
+
+    def assert_stats_match_orders(self):
+        for customer in Customer.objects.filter(user=self.user):
+            orders = WooCommerceOrder.objects.filter(customer=customer)
+            self.assertEqual(
+                (customer.total_spent, customer.orders_count), (sum(order.total for order in orders), orders.count()),
+                customer.email,
+            )
+
+    def test_customer_stats_follow_the_stored_orders(self):
+        importer = OrderImporter(self.user)
+        importer.import_page([order_payload(1, 'a@store.com', 10), order_payload(2, 'a@store.com', 10)])
+        self.assert_stats_match_orders()
+
+        # Re-importing the same orders, changed or not, never counts them twice
+        importer.import_page([order_payload(1, 'a@store.com', 10)])
+        importer.import_page([{**order_payload(1, 'a@store.com', 10), 'total': '50.00', 'date_modified': '2024-05-02T09:00:00'}])
+        self.assert_stats_match_orders()
+        self.assertEqual(Customer.objects.get(email='a@store.com').orders_count, 2)
+
+        # An order moving to another customer leaves the first one's totals
+        importer.import_page([{**order_payload(2, 'b@store.com', 10), 'date_modified': '2024-05-02T09:00:00'}])
+        self.assert_stats_match_orders()
+        self.assertEqual(
+            sorted(Customer.objects.values_list('email', 'orders_count')), [('a@store.com', 1), ('b@store.com', 1)],
+        )
+
+        WebhookBatcher(batch_size=10, flush_interval=1, max_size=10).flush([(self.user.pk, 'order.deleted', {'id': 1})])
+        self.assert_stats_match_orders()
+        self.assertEqual(Customer.objects.get(email='a@store.com').total_spent, 0)
+
+class OrderDetailQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='store')
+        category = Category.objects.create(user=cls.user, category_id=1, name='Shoes')
+        for product_id in (10, 11):
+            Product.objects.create(user=cls.user, product_id=product_id, name='Trainer', price='25.00', category=category)
+        pages = [
+            {**order_payload(number, f'customer{number}@store.com', 10), 'line_items': [
+                {'product_id': 10, 'variation_id': 0, 'quantity': 1, 'total': '25.00'},
+                {'product_id': 11, 'variation_id': 0, 'quantity': 2, 'total': '50.00'},
+            ]}
+            for number in range(55)
+        ]
+        OrderImporter(cls.user).import_page(pages)
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        for page_size in (5, 55):
+            with self.subTest(page_size=page_size):
+                # The page, then one prefetch each for items, shipping methods, coupons and taxes
+                with self.assertNumQueries(5):
+                    response = client.get(f'/data/order-details/?page_size={page_size}')
+                results = response.json()['results']
+                self.assertEqual(len(results), page_size)
+                self.assertEqual(results[0]['items'][0]['category_name'], 'Shoes')
+                self.assertTrue(results[0]['customer']['email'].endswith('@store.com'))
+
+
+class PurgeTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f'store{index}') for index in range(2)]
+        for index, user in enumerate(self.users):
+            category = Category.objects.create(user=user, category_id=1, name='Shoes')
+            Product.objects.create(user=user, product_id=10, name='Trainer', price='25.00', category=category)
+            SyncRecord.objects.create(user=user, last_sync_time=timezone.now(), catalogue_sync_time=timezone.now())
+            # Shipping addresses are identical across both stores, so those Address rows are shared
+            OrderImporter(user).import_page([
+                order_payload(1000 + number, f'customer{number % 3}@store{index}.com', 10) for number in range(7)
+            ])
+
+    def tenant_rows(self, user):
+        orders = WooCommerceOrder.objects.filter(user=user)
+        return {
+            'orders': orders.count(),
+            'children': sum(model.objects.filter(order__in=orders).count() for model in (OrderItem, ShippingMethod, Coupon, Tax)),
+            'owned': sum(model.objects.filter(user=user).count() for model in (
+                Customer, PaymentGateway, OrderArchive, DailySales, DailyProductSales, Product, Category,
+            )),
+        }
+
+    def test_purge_removes_one_tenant(self):
+        kept, purged = self.users[1], self.users[0]
+        before = self.tenant_rows(kept)
+        shared = set(WooCommerceOrder.objects.filter(user=kept).values_list('shipping_address', flat=True))
+        own = set(WooCommerceOrder.objects.filter(user=purged).values_list('billing_address', flat=True))
+        self.assertTrue(shared & set(WooCommerceOrder.objects.filter(user=purged).values_list('shipping_address', flat=True)))
+
+        progress = []
+        with CaptureQueriesContext(connection) as queries:
+            counts = purge_user(purged, chunk_size=3, progress=lambda stage, done, total: progress.append((stage, done, total)))
+
+        self.assertEqual(counts['orders'], 7)
+        self.assertEqual([entry for entry in progress if entry[0] == 'orders'], [('orders', 3, 7), ('orders', 6, 7), ('orders', 7, 7)])
+        self.assertEqual(self.tenant_rows(purged), {'orders': 0, 'children': 0, 'owned': 0})
+        self.assertIsNone(SyncRecord.objects.get(user=purged).catalogue_sync_time)
+
+        # Every chunk deletes the order children before the orders they point at
+        deletes = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('DELETE')]
+        order_deletes = [index for index, sql in enumerate(deletes) if sql.startswith('DELETE FROM "orderdata_woocommerceorder"')]
+        self.assertEqual(len(order_deletes), 3)
+        for index in order_deletes:
+            self.assertEqual(
+                [sql.split('"')[1] for sql in deletes[index - 4:index]],
+                ['orderdata_orderitem', 'orderdata_shippingmethod', 'orderdata_coupon', 'orderdata_tax'],
+            )
+
+        # The other store keeps everything, including the addresses both stores used
+        self.assertEqual(self.tenant_rows(kept), before)
+        self.assertEqual(Address.objects.filter(pk__in=shared).count(), len(shared))
+        self.assertFalse(Address.objects.filter(pk__in=own).exists())
+        self.assertIsNotNone(SyncRecord.objects.get(user=kept).catalogue_sync_time)
+
+
+class AddressDeduplicationMigrationTests(TransactionTestCase):
+    # Runs 0013_deduplicate_addresses on rows written in the schema before it, where every order had
+    # its own billing and shipping Address rows
+    migrate_from = [('orderdata', '0012_address_hash_and_links')]
+    migrate_to = [('orderdata', '0013_deduplicate_addresses')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        self.apps = executor.loader.project_state(self.migrate_from).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_addresses_are_shared_and_customers_use_the_latest(self):
+        User = self.apps.get_model('auth', 'User')
+        Customer = self.apps.get_model('orderdata', 'Customer')
+        Order = self.apps.get_model('orderdata', 'WooCommerceOrder')
+        OldAddress = self.apps.get_model('orderdata', 'Address')
+
+        user = User.objects.create(username='store')
+        depot = {'first_name': 'A', 'city': 'London', 'address_1': '1 Depot Road'}
+        orders = {}
+        for email, order_id, billing in (
+            ('moved@store.com', 1, {'first_name': 'A', 'city': 'Leeds', 'email': 'moved@store.com'}),
+            ('moved@store.com', 2, {'first_name': 'A', 'city': 'York', 'email': 'moved@store.com'}),
+            ('other@store.com', 3, {'first_name': 'B', 'city': 'Bath', 'email': 'other@store.com'}),
+        ):
+            customer, _ = Customer.objects.get_or_create(user=user, email=email, first_name='A', last_name='B')
+            order = Order.objects.create(
+                user=user, order_id=order_id, status='completed', total=10, customer=customer,
+                date_created=timezone.now(), date_modified=timezone.now(),
+            )
+            # Every order stored its own copy of the shared depot shipping address
+            for address_type, address in (('billing', billing), ('shipping', depot)):
+                OldAddress.objects.create(order=order, customer=customer, address_type=address_type, address=address)
+            orders[order_id] = order.pk
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_to)
+        apps = executor.loader.project_state(self.migrate_to).apps
+        Address = apps.get_model('orderdata', 'Address')
+        Customer = apps.get_model('orderdata', 'Customer')
+        Order = apps.get_model('orderdata', 'WooCommerceOrder')
+
+        self.assertEqual(Address.objects.count(), 4)
+        self.assertFalse(Address.objects.filter(address_hash__isnull=True).exists())
+        shipping = set(Order.objects.values_list('shipping_address', flat=True))
+        self.assertEqual(len(shipping), 1)
+        self.assertEqual(Address.objects.get(pk=shipping.pop()).address, depot)
+
+        def address(pk):
+            return Address.objects.get(pk=pk).address
+
+        billing = {order.order_id: address(order.billing_address_id) for order in Order.objects.all()}
+        self.assertEqual([billing[order_id]['city'] for order_id in (1, 2, 3)], ['Leeds', 'York', 'Bath'])
+
+        moved = Customer.objects.get(email='moved@store.com')
+        latest = Order.objects.get(pk=orders[2])
+        self.assertEqual(
+            (moved.billing_address_id, moved.shipping_address_id), (latest.billing_address_id, latest.shipping_address_id),
+        )
+        self.assertEqual(address(moved.billing_address_id)['city'], 'York')
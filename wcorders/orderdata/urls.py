@@ -2,7 +2,8 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     CustomerViewSet, CategoryViewSet, ProductViewSet, WooCommerceOrderViewSet, OrderItemViewSet, 
-    AddressViewSet, PaymentGatewayViewSet, ShippingMethodViewSet, CouponViewSet, TaxViewSet
+    AddressViewSet, PaymentGatewayViewSet, ShippingMethodViewSet, CouponViewSet, TaxViewSet,
+    JobViewSet, OrderDetailViewSet, RevenueView, LeaderboardView, WooCommerceWebhookView
 )
 
 router = DefaultRouter()
@@ -10,13 +11,19 @@ router.register(r'customers', CustomerViewSet)
 router.register(r'categories', CategoryViewSet)
 router.register(r'products', ProductViewSet)
 router.register(r'orders', WooCommerceOrderViewSet)
+router.register(r'order-details', OrderDetailViewSet, basename='order-detail')
 router.register(r'order-items', OrderItemViewSet)
 router.register(r'addresses', AddressViewSet)
 router.register(r'payment-gateways', PaymentGatewayViewSet)
 router.register(r'shipping-methods', ShippingMethodViewSet)
 router.register(r'coupons', CouponViewSet)
 router.register(r'taxes', TaxViewSet)
+router.register(r'jobs', JobViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('analytics/revenue/', RevenueView.as_view(), name='analytics-revenue'),
+    path('analytics/leaderboard/products/', LeaderboardView.as_view(group='products'), name='leaderboard-products'),
+    path('analytics/leaderboard/categories/', LeaderboardView.as_view(group='categories'), name='leaderboard-categories'),
+    path('webhooks/<int:user_id>/', WooCommerceWebhookView.as_view(), name='woocommerce-webhook'),
 ]
@@ -1,32 +1,98 @@
-from rest_framework import viewsets, filters
+import queue
+from rest_framework import mixins, viewsets, filters, status
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
-from django.db.models import Q
+from django.db.models import Prefetch
 from datetime import timedelta
 
+from authentication.models import WooCommerceCredentials
+from . import codec
+from .analytics import (
+    LEADERBOARD_METRICS, category_leaderboard, label_products, product_leaderboard, revenue_series,
+)
+from .importer import refresh_customer_stats, write_transaction
+from .jobs import enqueue
+from .pagination import LeaderboardPagination, OrderCursorPagination
+from .rollups import local_date, refresh_daily_rollups
+from .tenants import scope_to_tenant
+from .webhooks import batcher, verify_signature, UPSERT_TOPICS, DELETE_TOPICS
+
 from .models import (
     Customer, Category, Product, WooCommerceOrder, OrderItem, 
-    Address, PaymentGateway, ShippingMethod, Coupon, Tax
+    Address, PaymentGateway, ShippingMethod, Coupon, Tax, Job
 )
 from .serializers import (
     CustomerSerializer, CategorySerializer, ProductSerializer, WooCommerceOrderSerializer, OrderItemSerializer, 
-    AddressSerializer, PaymentGatewaySerializer, ShippingMethodSerializer, CouponSerializer, TaxSerializer
+    AddressSerializer, PaymentGatewaySerializer, ShippingMethodSerializer, CouponSerializer, TaxSerializer,
+    JobSerializer, OrderDetailSerializer, RevenueQuerySerializer, RevenueBucketSerializer,
+    LeaderboardQuerySerializer, ProductSalesSerializer, CategorySalesSerializer
 )
 
-class CustomerViewSet(viewsets.ModelViewSet):
+class TenantScopedMixin:
+    # Restricts a viewset to the authenticated user's store (see tenants.scope_to_tenant); models
+    # with their own user column get it set on create
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return scope_to_tenant(super().get_queryset(), self.request.user)
+
+    def perform_create(self, serializer):
+        if any(field.name == 'user' for field in self.queryset.model._meta.concrete_fields):
+            serializer.save(user=self.request.user)
+        else:
+            serializer.save()
+
+class RollupRefreshMixin:
+    # For endpoints writing orders or their children: like the importer, every write recomputes the
+    # daily rollups and customer stats of the orders it touched, before and after, in its transaction
+
+    def order_state(self, instance):
+        order = instance if isinstance(instance, WooCommerceOrder) else instance.order
+        return order.customer_id, local_date(order.date_created)
+
+    def refresh_rollups(self, states):
+        refresh_customer_stats({customer_id for customer_id, _ in states})
+        refresh_daily_rollups(self.request.user, {day for _, day in states})
+
+    def perform_create(self, serializer):
+        with write_transaction():
+            super().perform_create(serializer)
+            self.refresh_rollups({self.order_state(serializer.instance)})
+
+    def perform_update(self, serializer):
+        with write_transaction():
+            before = self.order_state(serializer.instance)
+            super().perform_update(serializer)
+            self.refresh_rollups({before, self.order_state(serializer.instance)})
+
+    def perform_destroy(self, instance):
+        with write_transaction():
+            before = self.order_state(instance)
+            super().perform_destroy(instance)
+            self.refresh_rollups({before})
+
+class CustomerViewSet(TenantScopedMixin, viewsets.ModelViewSet):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
 
-class CategoryViewSet(viewsets.ModelViewSet):
+# The catalogue and addresses are written only by the importer (addresses are also shared between
+# stores), so their endpoints are read-only
+
+class CategoryViewSet(TenantScopedMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(TenantScopedMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
 
-class WooCommerceOrderViewSet(viewsets.ModelViewSet):
+class WooCommerceOrderViewSet(RollupRefreshMixin, TenantScopedMixin, viewsets.ModelViewSet):
     queryset = WooCommerceOrder.objects.all()
     serializer_class = WooCommerceOrderSerializer
+    pagination_class = OrderCursorPagination
 
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -45,26 +111,136 @@ class WooCommerceOrderViewSet(viewsets.ModelViewSet):
 
         return queryset.filter(date_created__gte=filter_date)
 
-class OrderItemViewSet(viewsets.ModelViewSet):
+class OrderDetailViewSet(WooCommerceOrderViewSet):
+    # Orders with their items, addresses, shipping, coupons, taxes, customer and gateway in one
+    # response: three joins plus four prefetches, whatever the page size
+    queryset = WooCommerceOrder.objects.select_related(
+        'customer', 'payment_gateway', 'billing_address', 'shipping_address',
+    ).prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.select_related('product__category')),
+        'shippingmethod_set',
+        'coupon_set',
+        'tax_set',
+    )
+    serializer_class = OrderDetailSerializer
+    http_method_names = ['get', 'head', 'options']
+
+class OrderItemViewSet(RollupRefreshMixin, TenantScopedMixin, viewsets.ModelViewSet):
     queryset = OrderItem.objects.all()
     serializer_class = OrderItemSerializer
 
-class AddressViewSet(viewsets.ModelViewSet):
+class AddressViewSet(TenantScopedMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Address.objects.all()
     serializer_class = AddressSerializer
 
-class PaymentGatewayViewSet(viewsets.ModelViewSet):
+class PaymentGatewayViewSet(TenantScopedMixin, viewsets.ModelViewSet):
     queryset = PaymentGateway.objects.all()
     serializer_class = PaymentGatewaySerializer
 
-class ShippingMethodViewSet(viewsets.ModelViewSet):
+class ShippingMethodViewSet(RollupRefreshMixin, TenantScopedMixin, viewsets.ModelViewSet):
     queryset = ShippingMethod.objects.all()
     serializer_class = ShippingMethodSerializer
 
-class CouponViewSet(viewsets.ModelViewSet):
+class CouponViewSet(RollupRefreshMixin, TenantScopedMixin, viewsets.ModelViewSet):
     queryset = Coupon.objects.all()
     serializer_class = CouponSerializer
 
-class TaxViewSet(viewsets.ModelViewSet):
+class TaxViewSet(RollupRefreshMixin, TenantScopedMixin, viewsets.ModelViewSet):
     queryset = Tax.objects.all()
     serializer_class = TaxSerializer
+
+class JobViewSet(
+    TenantScopedMixin, mixins.CreateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet
+):
+    queryset = Job.objects.all().order_by('-created_at')
+    serializer_class = JobSerializer
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job, created = enqueue(request.user, serializer.validated_data['kind'])
+        return Response(
+            self.get_serializer(job).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+class RevenueView(APIView):
+    # Gross revenue, refunds, net revenue, order count and AOV per hour/day/week/month bucket
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = RevenueQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        query = params.validated_data
+        buckets = revenue_series(
+            request.user,
+            query['start'],
+            query['end'],
+            interval=query['interval'],
+            tzinfo=query.get('tz'),
+            statuses=sorted(query['status']) if query.get('status') else None,
+        )
+        # Buckets are reported in the zone they were aligned to
+        with timezone.override(query.get('tz') or timezone.get_current_timezone()):
+            return Response({
+                'interval': query['interval'],
+                'start': query['start'],
+                'end': query['end'],
+                'results': RevenueBucketSerializer(buckets, many=True).data,
+            })
+
+class LeaderboardView(APIView):
+    # Products or categories ranked by revenue, units sold or order count over a date range;
+    # `?page_size=N` gives the top N and the next link continues the ranking
+    permission_classes = [IsAuthenticated]
+    group = 'products'
+
+    def get(self, request):
+        params = LeaderboardQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        query = params.validated_data
+        if self.group == 'products':
+            rows = product_leaderboard(request.user, query['start'], query['end'])
+            key, serializer_class = 'wc_product_id', ProductSalesSerializer
+        else:
+            rows = category_leaderboard(request.user, query['start'], query['end'])
+            key, serializer_class = 'category_id', CategorySalesSerializer
+
+        self.ordering = (LEADERBOARD_METRICS[query['metric']], key)
+        paginator = LeaderboardPagination()
+        page = paginator.paginate_queryset(rows, request, view=self)
+        if self.group == 'products':
+            label_products(request.user, page)
+        return paginator.get_paginated_response(serializer_class(page, many=True).data)
+
+class WooCommerceWebhookView(APIView):
+    # Receives order webhooks from a store; authenticated by the HMAC signature, not by a user session
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request, user_id):
+        credentials = get_object_or_404(WooCommerceCredentials, user_id=user_id)
+        body = request.body
+        topic = request.headers.get('X-WC-Webhook-Topic')
+
+        # WooCommerce pings a new webhook with an unsigned form body before the first delivery
+        if topic is None and body.startswith(b'webhook_id='):
+            return Response(status=status.HTTP_200_OK)
+
+        secret = credentials.webhook_secret or credentials.consumer_secret
+        if not verify_signature(secret, body, request.headers.get('X-WC-Webhook-Signature')):
+            return Response({'error': 'Invalid signature'}, status=status.HTTP_401_UNAUTHORIZED)
+        if topic not in UPSERT_TOPICS | DELETE_TOPICS:
+            return Response({'error': f'Unsupported topic {topic}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            payload = codec.loads(body)
+            payload['id']
+        except (ValueError, TypeError, KeyError):
+            return Response({'error': 'Invalid payload'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            batcher.enqueue(credentials.user_id, topic, payload)
+        except queue.Full:
+            return Response({'error': 'Webhook buffer full'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(status=status.HTTP_202_ACCEPTED)
@@ -0,0 +1,118 @@
+import base64
+import hashlib
+import hmac
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_old_connections
+
+from .importer import OrderImporter, payload_modified, refresh_customer_stats, write_transaction
+from .rollups import local_date, refresh_daily_rollups
+from .models import OrderArchive, WooCommerceOrder
+
+logger = logging.getLogger(__name__)
+
+UPSERT_TOPICS = {'order.created', 'order.updated', 'order.restored'}
+DELETE_TOPICS = {'order.deleted'}
+
+
+def verify_signature(secret, body, signature):
+    # WooCommerce signs the raw request body with HMAC-SHA256 and sends it base64 encoded
+    expected = base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+    return hmac.compare_digest(expected, signature or '')
+
+
+class WebhookBatcher:
+    # Buffers webhook payloads in memory and writes them from a background thread, either when
+    # `batch_size` orders are waiting or `flush_interval` seconds after the first one arrived.
+    # The buffer is lost if the process dies; the scheduled modified_after sync picks those orders up.
+
+    def __init__(self, batch_size, flush_interval, max_size):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.events = queue.Queue(maxsize=max_size)
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def enqueue(self, user_id, topic, payload):
+        # Raises queue.Full when the writer cannot keep up
+        self.events.put_nowait((user_id, topic, payload))
+        self.ensure_started()
+
+    def ensure_started(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='webhook-writer', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            batch = [self.events.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.events.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            close_old_connections()
+            try:
+                self.flush(batch)
+            except Exception:
+                logger.exception("Failed to write %d webhook events", len(batch))
+
+    def flush(self, batch):
+        # Every store is written in its own transaction, so a malformed delivery or a deleted
+        # account only loses that store's events
+        by_user = defaultdict(list)
+        for user_id, topic, payload in batch:
+            by_user[user_id].append((topic, payload))
+        for user_id, events in by_user.items():
+            try:
+                self.flush_user(user_id, events)
+            except Exception:
+                logger.exception("Failed to write %d webhook events for user %s", len(events), user_id)
+
+    def flush_user(self, user_id, events):
+        # Only the last event per order matters: an update followed by a delete is just a delete.
+        # Deliveries can arrive out of order, so an update older than one already seen is dropped.
+        latest = {}
+        for topic, payload in events:
+            previous = latest.get(payload['id'])
+            if (
+                previous and topic in UPSERT_TOPICS and previous[0] in UPSERT_TOPICS
+                and payload_modified(payload) < payload_modified(previous[1])
+            ):
+                continue
+            latest[payload['id']] = (topic, payload)
+
+        user = User.objects.get(pk=user_id)
+        upserts = [payload for topic, payload in latest.values() if topic in UPSERT_TOPICS]
+        deletes = [order_id for order_id, (topic, _) in latest.items() if topic in DELETE_TOPICS]
+        with write_transaction():
+            if upserts:
+                OrderImporter(user).import_page(upserts)
+            if deletes:
+                deleted = WooCommerceOrder.objects.filter(user=user, order_id__in=deletes)
+                previous = set(deleted.values_list('customer_id', 'date_created'))
+                deleted.delete()
+                # Otherwise rebuild_from_archive would bring the deleted orders back
+                OrderArchive.objects.filter(user=user, order_id__in=deletes).delete()
+                refresh_customer_stats({customer_id for customer_id, _ in previous})
+                refresh_daily_rollups(user, {local_date(date) for _, date in previous})
+        logger.info("Webhooks for %s: %d orders upserted, %d deleted", user, len(upserts), len(deletes))
+
+
+batcher = WebhookBatcher(
+    batch_size=getattr(settings, 'WEBHOOK_BATCH_SIZE', 100),
+    flush_interval=getattr(settings, 'WEBHOOK_FLUSH_INTERVAL_MS', 500) / 1000,
+    max_size=getattr(settings, 'WEBHOOK_BUFFER_SIZE', 10000),
+)
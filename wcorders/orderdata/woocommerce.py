@@ -0,0 +1,187 @@
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from . import codec
+
+logger = logging.getLogger(__name__)
+
+WooCommercePage = namedtuple('WooCommercePage', ['items', 'total', 'total_pages'])
+
+
+class WooCommerceError(Exception):
+    pass
+
+
+class WooCommerceConnectionError(WooCommerceError):
+    pass
+
+
+class WooCommerceTimeout(WooCommerceConnectionError):
+    pass
+
+
+class WooCommerceResponseError(WooCommerceError):
+    # A 200 response whose body is not the JSON document it should be, e.g. a proxy's HTML error page
+    pass
+
+
+class WooCommerceAPIError(WooCommerceError):
+    def __init__(self, endpoint, status_code, body):
+        self.endpoint = endpoint
+        self.status_code = status_code
+        self.body = body
+        super().__init__(f"Failed to fetch {endpoint}: {status_code} {body[:200]}")
+
+
+class TokenBucket:
+    # Allows `rate` requests per second on average with bursts of up to `capacity`
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_rate_limiter(store_url):
+    # One bucket per store so every client talking to the same store shares the budget
+    with _buckets_lock:
+        bucket = _buckets.get(store_url)
+        if bucket is None:
+            rate = getattr(settings, 'WOOCOMMERCE_REQUESTS_PER_SECOND', 5)
+            burst = getattr(settings, 'WOOCOMMERCE_REQUEST_BURST', 10)
+            bucket = _buckets[store_url] = TokenBucket(rate, burst)
+        return bucket
+
+
+class WooCommerceClient:
+    RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self.base_url = f"{credentials.store_url.rstrip('/')}/wp-json/wc/v3"
+        self.timeout = getattr(settings, 'WOOCOMMERCE_TIMEOUT', 10)
+        self.max_retries = getattr(settings, 'WOOCOMMERCE_MAX_RETRIES', 5)
+        self.backoff = getattr(settings, 'WOOCOMMERCE_BACKOFF', 0.5)
+        self.max_concurrency = max(1, credentials.max_concurrency)
+        self.rate_limiter = get_rate_limiter(credentials.store_url)
+
+        self.session = requests.Session()
+        self.session.auth = (credentials.consumer_key, credentials.consumer_secret)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def request(self, endpoint, params=None):
+        url = f"{self.base_url}/{endpoint}"
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            response = None
+            logger.debug("Fetching %s with %s (attempt %d)", url, params, attempt + 1)
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except requests.exceptions.Timeout as e:
+                error = WooCommerceTimeout(f"Request to {endpoint} timed out.")
+                error.__cause__ = e
+            except requests.exceptions.RequestException as e:
+                error = WooCommerceConnectionError(f"Request to {endpoint} failed: {e}")
+                error.__cause__ = e
+            else:
+                if response.status_code == 200:
+                    return response
+                error = WooCommerceAPIError(endpoint, response.status_code, response.text)
+                if response.status_code not in self.RETRY_STATUS_CODES:
+                    raise error
+
+            if attempt == self.max_retries:
+                raise error
+            delay = self.retry_delay(attempt, response)
+            logger.warning("%s; retrying in %.1fs", error, delay)
+            time.sleep(delay)
+
+    def retry_delay(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff * (2 ** attempt)
+
+    def get(self, endpoint, params=None):
+        return self.get_page(endpoint, params).items
+
+    def get_page(self, endpoint, params=None):
+        response = self.request(endpoint, params)
+        try:
+            # requests negotiates gzip itself; decode the raw bytes once with the fast codec
+            items = codec.loads(response.content)
+            total = int(response.headers.get('X-WP-Total', len(items) if isinstance(items, list) else 1))
+            total_pages = int(response.headers.get('X-WP-TotalPages', 1))
+        except ValueError as e:
+            raise WooCommerceResponseError(f"Invalid response from {endpoint}: {e}") from e
+        return WooCommercePage(items, total, total_pages)
+
+    def iter_pages(self, endpoint, params=None, concurrency=None):
+        # Yields (page_number, items) in page order. Pages after the first are fetched in parallel,
+        # but only `concurrency` of them are in flight at once so memory stays bounded when the
+        # consumer is slower than the API.
+        params = dict(params or {})
+        first = self.get_page(endpoint, {**params, 'page': 1})
+        logger.info("%s %s across %s pages", first.total, endpoint, first.total_pages)
+        yield 1, first.items
+        rest = self.iter_page_range(endpoint, params, range(2, first.total_pages + 1), concurrency)
+        for page, result in rest:
+            yield page, result.items
+
+    def iter_page_range(self, endpoint, params, pages, concurrency=None):
+        # Yields (page_number, WooCommercePage) for the given page numbers in order, fetching up to
+        # `concurrency` of them in parallel
+        def fetch(page):
+            return self.get_page(endpoint, {**params, 'page': page})
+
+        workers = concurrency or self.max_concurrency
+        pages = iter(pages)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque((page, executor.submit(fetch, page)) for page in islice(pages, workers))
+            try:
+                while pending:
+                    page, future = pending.popleft()
+                    result = future.result()
+                    next_page = next(pages, None)
+                    if next_page is not None:
+                        pending.append((next_page, executor.submit(fetch, next_page)))
+                    yield page, result
+            finally:
+                for _, future in pending:
+                    future.cancel()
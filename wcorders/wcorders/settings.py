@@ -47,6 +47,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     "django.middleware.security.SecurityMiddleware",
+    "django.middleware.gzip.GZipMiddleware",  # Compresses responses when the client sends Accept-Encoding: gzip
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -88,6 +89,9 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "OPTIONS": {
+            "timeout": 20,  # Seconds to wait for the write lock when several stores sync at once
+        },
     }
 }
 
@@ -138,8 +142,47 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         # 'rest_framework.authentication.SessionAuthentication',
         # 'rest_framework.authentication.BasicAuthentication',
+        'rest_framework_simplejwt.authentication.JWTAuthentication',  # The token issued by LoginView
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.AllowAny',
     ),
+    # orjson-backed when installed, stdlib json otherwise
+    'DEFAULT_RENDERER_CLASSES': (
+        'orderdata.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    # Cursor pagination on every list endpoint; orders override it to page by (date_created, id)
+    'DEFAULT_PAGINATION_CLASS': 'orderdata.pagination.IdCursorPagination',
+    'DEFAULT_PARSER_CLASSES': (
+        'orderdata.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 }
+
+# WooCommerce REST API client
+WOOCOMMERCE_TIMEOUT = 10  # Seconds per request
+WOOCOMMERCE_MAX_RETRIES = 5  # Retries on 429/5xx and network errors
+WOOCOMMERCE_BACKOFF = 0.5  # Base delay in seconds, doubled on every retry
+WOOCOMMERCE_REQUESTS_PER_SECOND = 5  # Token bucket refill rate per store
+WOOCOMMERCE_REQUEST_BURST = 10  # Token bucket capacity per store
+
+# Sync scheduler (run_sync_scheduler)
+SYNC_WORKERS = 4  # Stores synced at the same time across the whole fleet
+SYNC_MIN_INTERVAL = 60  # Seconds; polling floor for the busiest stores
+SYNC_MAX_INTERVAL = 6 * 60 * 60  # Seconds; polling ceiling for quiet stores
+SYNC_TARGET_ORDERS_PER_POLL = 100  # Aim for about one page of changed orders per poll
+
+# WooCommerce order webhooks (orderdata.webhooks)
+WEBHOOK_BATCH_SIZE = 100  # Orders written per flush at most
+WEBHOOK_FLUSH_INTERVAL_MS = 500  # Longest a received webhook waits before being written
+WEBHOOK_BUFFER_SIZE = 10000  # Pending webhooks before new ones are rejected with 503
+
+# Database job queue (run_workers)
+JOB_WORKERS = 2  # Jobs run at the same time by one run_workers process
+JOB_POLL_INTERVAL = 5  # Seconds an idle worker waits before checking the queue again
+JOB_RETRY_DELAY = 60  # Seconds before the first retry, doubled on every further attempt
+JOB_HEARTBEAT_INTERVAL = 60  # Seconds between lock renewals of a running job
+JOB_LOCK_TIMEOUT = 10 * 60  # Seconds without a heartbeat after which a running job is assumed dead and requeued
+JOB_OUTPUT_LIMIT = 20000  # Characters of command output kept on the job